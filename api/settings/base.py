@@ -147,6 +147,16 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Celery
 CELERY_BROKER_URL = config("CELERY_BROKER_URL")
 CELERY_RESULT_BACKEND = config("REDIS_BACKEND")
+CELERY_BEAT_SCHEDULE = {
+    "rmon-schedule-refreshes": {
+        "task": "rmon.tasks.schedule_refreshes",
+        "schedule": config("RMON_SCHEDULER_TICK", default=60, cast=int),
+    },
+    "rmon-compact-costs": {
+        "task": "rmon.tasks.compact_costs",
+        "schedule": config("RMON_COST_COMPACTION_INTERVAL", default=3600, cast=int),
+    },
+}
 
 
 # DRF Spectacular
@@ -175,6 +185,66 @@ AWS_REGION = config('aws_region')
 BUCKET_NAME = config('bucket_name')
 OBJECT_KEY = config('object_key')
 
+# RMON INGEST
+RMON_INGEST_BATCH_SIZE = config("RMON_INGEST_BATCH_SIZE", default=1000, cast=int)
+# replace: rewrite every row on each refresh, incremental: apply a diff
+RMON_SYNC_MODE = config("RMON_SYNC_MODE", default="replace")
+# copy: replace-mode batches go through COPY into staging tables and one
+# merge statement (PostgreSQL only), orm: bulk_create upserts
+RMON_INGEST_LOADER = config("RMON_INGEST_LOADER", default="copy")
+# m2m: regional resources linked to Region through many-to-many tables,
+# fk: through their region_ref column (run backfill_region_refs first)
+RMON_REGION_SCHEMA = config("RMON_REGION_SCHEMA", default="m2m")
+# Write each refresh as a new generation and switch readers to it on
+# commit; readers never see a partly written or partly committed run
+RMON_SNAPSHOT_GENERATIONS = config("RMON_SNAPSHOT_GENERATIONS", default=False, cast=bool)
+# Regions ingested concurrently (PostgreSQL only, 1 = serial)
+RMON_INGEST_WORKERS = config("RMON_INGEST_WORKERS", default=1, cast=int)
+RMON_INGEST_QUEUE_SIZE = config("RMON_INGEST_QUEUE_SIZE", default=4, cast=int)
+RMON_INGEST_LOCK_TIMEOUT = config("RMON_INGEST_LOCK_TIMEOUT", default="30s")
+RMON_INGEST_STREAMING = config("RMON_INGEST_STREAMING", default=True, cast=bool)
+RMON_STREAM_CHUNK_SIZE = config("RMON_STREAM_CHUNK_SIZE", default=65536, cast=int)
+
+# RMON READ ENDPOINTS
+RMON_RESOURCE_PAGE_SIZE = config("RMON_RESOURCE_PAGE_SIZE", default=100, cast=int)
+RMON_RESOURCE_MAX_PAGE_SIZE = config("RMON_RESOURCE_MAX_PAGE_SIZE", default=1000, cast=int)
+RMON_STREAM_QUERY_CHUNK_SIZE = config("RMON_STREAM_QUERY_CHUNK_SIZE", default=2000, cast=int)
+RMON_COST_RANGE_MAX_POINTS = config("RMON_COST_RANGE_MAX_POINTS", default=1000, cast=int)
+RMON_SAVINGS_RANKING_SIZE = config("RMON_SAVINGS_RANKING_SIZE", default=500, cast=int)
+RMON_REGION_DOCUMENTS = config("RMON_REGION_DOCUMENTS", default=True, cast=bool)
+RMON_FAST_JSON = config("RMON_FAST_JSON", default=False, cast=bool)
+if RMON_FAST_JSON:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] = (
+        'rmon.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    )
+
+# REPORT SNAPSHOTS
+RMON_SNAPSHOT_ROOT = config("RMON_SNAPSHOT_ROOT", default=str(BASE_DIR.parent / "snapshots"))
+RMON_SNAPSHOT_KEEP = config("RMON_SNAPSHOT_KEEP", default=10, cast=int)
+RMON_SNAPSHOT_MAX_AGE_DAYS = config("RMON_SNAPSHOT_MAX_AGE_DAYS", default=30, cast=int)
+RMON_SNAPSHOT_COMPRESSLEVEL = config("RMON_SNAPSHOT_COMPRESSLEVEL", default=6, cast=int)
+
+# COST HISTORY RETENTION
+# Raw history and hourly/daily rollups are deleted after this many days,
+# once compacted into the next level; monthly rollups are kept. Ranges
+# without a bucket fall back to rollup averages where raw rows are gone.
+RMON_COST_RAW_RETENTION_DAYS = config("RMON_COST_RAW_RETENTION_DAYS", default=7, cast=int)
+RMON_COST_HOURLY_RETENTION_DAYS = config("RMON_COST_HOURLY_RETENTION_DAYS", default=90, cast=int)
+RMON_COST_DAILY_RETENTION_DAYS = config("RMON_COST_DAILY_RETENTION_DAYS", default=730, cast=int)
+
+# SCHEDULED REFRESHES
+RMON_REFRESH_INTERVAL = config("RMON_REFRESH_INTERVAL", default=3600, cast=int)
+RMON_REFRESH_MAX_CONCURRENCY = config("RMON_REFRESH_MAX_CONCURRENCY", default=4, cast=int)
+RMON_REFRESH_JITTER = config("RMON_REFRESH_JITTER", default=60, cast=int)
+RMON_REFRESH_BACKOFF_MAX = config("RMON_REFRESH_BACKOFF_MAX", default=86400, cast=int)
+RMON_REFRESH_JOB_TIMEOUT = config("RMON_REFRESH_JOB_TIMEOUT", default=3600, cast=int)
+
+# S3 CLIENT CACHE
+RMON_S3_CLIENT_CACHE_SIZE = config("RMON_S3_CLIENT_CACHE_SIZE", default=32, cast=int)
+RMON_S3_CLIENT_TTL = config("RMON_S3_CLIENT_TTL", default=3600, cast=int)
+RMON_S3_MAX_POOL_CONNECTIONS = config("RMON_S3_MAX_POOL_CONNECTIONS", default=10, cast=int)
+
 # AUTH
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
@@ -8,6 +8,10 @@ class AWSAccountCredentials(models.Model):
     aws_region = models.CharField(max_length=50)
     bucket_name = models.CharField(max_length=100)
     object_key = models.CharField(max_length=100)
+    # Validators of the last report ingested, sent back to S3 so unchanged
+    # reports are not downloaded again
+    report_etag = models.CharField(max_length=255, blank=True)
+    report_last_modified = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return f"AWS Credentials for {self.user.username}"
\ No newline at end of file
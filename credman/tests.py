@@ -1,3 +1,63 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from rmon.models import CumulativeCostHistory
+from .models import AWSAccountCredentials
+
+
+def credentials_payload(**overrides):
+    return {
+        'aws_access_key_id': 'AKIAEXAMPLE',
+        'aws_secret_access_key': 'secret',
+        'aws_region': 'us-east-1',
+        'bucket_name': 'reports',
+        'object_key': 'report.json',
+        **overrides,
+    }
+
+
+@mock.patch('credman.views.get_s3_client')
+class SaveAWSCredentialsViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('credentials-manager:save_aws_credentials')
+
+    def test_saving_again_updates_the_row(self, get_s3_client):
+        self.assertEqual(self.client.post(self.url, credentials_payload()).status_code, 201)
+        account = AWSAccountCredentials.objects.get(user=self.user)
+        AWSAccountCredentials.objects.filter(pk=account.pk).update(report_etag='"abc"')
+        CumulativeCostHistory.objects.create(account=account)
+
+        response = self.client.post(self.url, credentials_payload(aws_secret_access_key='rotated'))
+
+        self.assertEqual(response.status_code, 201)
+        updated = AWSAccountCredentials.objects.get(user=self.user)
+        self.assertEqual(updated.pk, account.pk)
+        self.assertEqual(updated.aws_secret_access_key, 'rotated')
+        self.assertEqual(updated.report_etag, '')
+        self.assertEqual(CumulativeCostHistory.objects.filter(account=account).count(), 1)
+
+    def test_invalid_credentials_are_not_saved(self, get_s3_client):
+        get_s3_client.return_value.list_buckets.side_effect = RuntimeError('denied')
+
+        response = self.client.post(self.url, credentials_payload())
+
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(AWSAccountCredentials.objects.filter(user=self.user).exists())
+
+    def test_users_with_cost_history_can_be_deleted(self, get_s3_client):
+        self.client.post(self.url, credentials_payload())
+        CumulativeCostHistory.objects.create(
+            account=AWSAccountCredentials.objects.get(user=self.user))
+
+        self.user.delete()
 
-# Create your tests here.
+        self.assertFalse(AWSAccountCredentials.objects.exists())
+        self.assertFalse(CumulativeCostHistory.objects.exists())
@@ -1,4 +1,3 @@
-import boto3
 from botocore.exceptions import NoCredentialsError, PartialCredentialsError, BotoCoreError, ClientError
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -6,6 +5,7 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from .models import AWSAccountCredentials
 from .serializers import AWSAccountCredentialsSerializer
+from rmon.helpers.aws_clients import get_s3_client, evict_s3_client
 
 class SaveAWSCredentialsView(APIView):
     permission_classes = [IsAuthenticated]
@@ -21,20 +21,26 @@ class SaveAWSCredentialsView(APIView):
             
             # Attempt to create an S3 client to validate credentials
             try:
-                s3_client = boto3.client(
-                    's3',
-                    aws_access_key_id=aws_access_key_id,
-                    aws_secret_access_key=aws_secret_access_key,
-                    region_name=aws_region
+                s3_client = get_s3_client(
+                    aws_access_key_id,
+                    aws_secret_access_key,
+                    aws_region
                 )
                 # Attempt to list S3 buckets to verify credentials
-                s3_client.list_buckets()
+                try:
+                    s3_client.list_buckets()
+                except Exception:
+                    # Don't keep a client for credentials that don't work
+                    evict_s3_client(aws_access_key_id, aws_secret_access_key, aws_region)
+                    raise
                 
-                # Remove any existing credentials for the user
-                AWSAccountCredentials.objects.filter(user=request.user).delete()
-                
-                # Save the new credentials
-                serializer.save(user=request.user)
+                # Update the user's credentials in place: the account's
+                # resources and cost history belong to this row. The report
+                # may have moved, so the next refresh downloads it again.
+                AWSAccountCredentials.objects.update_or_create(
+                    user=request.user,
+                    defaults={**serializer.validated_data,
+                              'report_etag': '', 'report_last_modified': None})
 
                 return Response({"message": "AWS credentials saved successfully."}, status=201)
             except NoCredentialsError:
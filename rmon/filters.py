@@ -0,0 +1,72 @@
+from rest_framework import filters
+from rest_framework.exceptions import ValidationError
+
+# Query parameter filters for the per-type resource lists. region and
+# potential_cost_savings have B-tree indexes behind the account and
+# generation; tags a GIN index for the jsonb containment (@>) used for tag=,
+# though within one account the planner mostly filters the account's rows.
+
+# Models name the instance type differently
+INSTANCE_TYPE_FIELDS = ('instance_type', 'db_instance_class')
+
+ORDERING_FIELDS = ('id', 'region', 'potential_cost_savings', 'launch_time',
+                   'creation_date', 'age', 'size')
+
+
+def model_fields(model):
+    return {field.name for field in model._meta.concrete_fields}
+
+
+class ResourceFilter(filters.BaseFilterBackend):
+    # ?region=us-east-1,eu-west-1 &instance_type=t3.micro
+    # &tag=Key or &tag=Key:Value (repeatable, all must match)
+    # &min_savings=10.5
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        fields = model_fields(queryset.model)
+
+        regions = [region for region in params.get('region', '').split(',') if region]
+        if regions:
+            queryset = queryset.filter(region__in=regions)
+
+        instance_type = params.get('instance_type')
+        if instance_type:
+            field = next((name for name in INSTANCE_TYPE_FIELDS if name in fields), None)
+            if field is None:
+                raise ValidationError(
+                    {"instance_type": "This resource type has no instance type."})
+            queryset = queryset.filter(**{field: instance_type})
+
+        for tag in params.getlist('tag'):
+            key, sep, value = tag.partition(':')
+            if not key:
+                raise ValidationError({"tag": "Use tag=Key or tag=Key:Value."})
+            match = {"Key": key, "Value": value} if sep else {"Key": key}
+            queryset = queryset.filter(tags__contains=[match])
+
+        min_savings = params.get('min_savings')
+        if min_savings:
+            try:
+                min_savings = float(min_savings)
+            except ValueError:
+                raise ValidationError({"min_savings": "A number is required."})
+            queryset = queryset.filter(potential_cost_savings__gte=min_savings)
+
+        return queryset
+
+
+class ResourceOrderingFilter(filters.OrderingFilter):
+    # ?ordering=-potential_cost_savings; only fields the resource has
+
+    def get_valid_fields(self, queryset, view, context={}):
+        fields = model_fields(queryset.model)
+        return [(name, name) for name in ORDERING_FIELDS if name in fields]
+
+    def get_ordering(self, request, queryset, view):
+        # id breaks ties, so that the order is total as the cursor pagination
+        # needs; it follows the direction of the first field
+        ordering = list(super().get_ordering(request, queryset, view) or ())
+        if not any(field.lstrip('-') == 'id' for field in ordering):
+            ordering.append('-id' if ordering and ordering[0].startswith('-') else 'id')
+        return ordering
@@ -0,0 +1,41 @@
+from collections import namedtuple
+
+from django.conf import settings
+
+from credman.models import AWSAccountCredentials
+
+# rmon rows are scoped by the AWS account (stored credentials) they were
+# ingested for. A request reads the rows of its user's account, in the
+# generation that was live when it first looked (see helpers.generations).
+
+Scope = namedtuple('Scope', ['account_id', 'generation'])
+
+
+def request_scope(request):
+    # Resolved once, in one query, so every query of a request reads the
+    # same snapshot; no account for users without stored credentials
+    if not hasattr(request, '_rmon_scope'):
+        accounts = AWSAccountCredentials.objects.filter(user=request.user)
+        if settings.RMON_SNAPSHOT_GENERATIONS:
+            row = accounts.values_list('pk', 'live_generation__generation').first()
+        else:
+            # Every run writes generation 0 in place
+            row = accounts.values_list('pk', flat=True).first()
+            row = (row, 0) if row is not None else None
+        request._rmon_scope = Scope(row[0], row[1] or 0) if row else Scope(None, 0)
+    return request._rmon_scope
+
+
+def request_account_id(request):
+    return request_scope(request).account_id
+
+
+def scoped(queryset, scope):
+    # Rows of one account and, for generation-tagged tables, one
+    # generation; nothing for users without an account
+    if scope.account_id is None:
+        return queryset.none()
+    queryset = queryset.filter(account_id=scope.account_id)
+    if any(field.name == 'generation' for field in queryset.model._meta.concrete_fields):
+        queryset = queryset.filter(generation=scope.generation)
+    return queryset
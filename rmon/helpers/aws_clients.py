@@ -0,0 +1,61 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import boto3
+from botocore.config import Config
+from django.conf import settings
+
+# Process-wide cache of S3 clients keyed by credentials and region. Building
+# a client loads botocore's service model and a fresh connection pool, so
+# reusing them keeps refreshes off that cost and on warm keep-alive
+# connections. boto3 clients are thread-safe once created.
+_clients = OrderedDict()
+_lock = threading.Lock()
+
+
+def _cache_key(aws_access_key_id, aws_secret_access_key, aws_region):
+    secret = hashlib.sha256(aws_secret_access_key.encode()).hexdigest()
+    return (aws_access_key_id, secret, aws_region)
+
+
+def _create_client(aws_access_key_id, aws_secret_access_key, aws_region):
+    session = boto3.Session(
+        aws_access_key_id=aws_access_key_id,
+        aws_secret_access_key=aws_secret_access_key,
+        region_name=aws_region
+    )
+    config = Config(max_pool_connections=settings.RMON_S3_MAX_POOL_CONNECTIONS)
+    return session.client('s3', config=config)
+
+
+def get_s3_client(aws_access_key_id, aws_secret_access_key, aws_region):
+    key = _cache_key(aws_access_key_id, aws_secret_access_key, aws_region)
+    now = time.monotonic()
+
+    with _lock:
+        entry = _clients.get(key)
+        if entry is not None and now - entry[1] < settings.RMON_S3_CLIENT_TTL:
+            _clients.move_to_end(key)
+            return entry[0]
+
+    client = _create_client(aws_access_key_id, aws_secret_access_key, aws_region)
+
+    with _lock:
+        _clients[key] = (client, now)
+        _clients.move_to_end(key)
+        while len(_clients) > settings.RMON_S3_CLIENT_CACHE_SIZE:
+            _clients.popitem(last=False)
+    return client
+
+
+def evict_s3_client(aws_access_key_id, aws_secret_access_key, aws_region):
+    key = _cache_key(aws_access_key_id, aws_secret_access_key, aws_region)
+    with _lock:
+        _clients.pop(key, None)
+
+
+def clear_s3_clients():
+    with _lock:
+        _clients.clear()
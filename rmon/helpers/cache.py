@@ -0,0 +1,158 @@
+import hashlib
+import logging
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+
+from ..models import CumulativeCost
+from .accounts import request_account_id, request_scope, scoped
+
+logger = logging.getLogger(__name__)
+
+# Rendered responses of the rmon read endpoints are cached under keys that
+# contain the account and its data generation. Every committed ingest
+# moves the generation of its account to a new value, which makes all
+# earlier entries of that account unreachable at once without deleting or
+# scanning keys; they simply expire.
+#
+# Generations are taken from the clock (new_generation), not counted up:
+# when the generation key itself is evicted, the value it is seeded with
+# again has never been used, so no stale entry comes back.
+#
+# With RMON_SNAPSHOT_GENERATIONS a request reads the snapshot generation it
+# resolved first (accounts.request_scope). An ingest can commit and bump
+# the cache generation right after that, so the snapshot generation is
+# part of the keys and ETags as well: an old snapshot is never stored
+# under the new cache generation.
+#
+# The generation and the time of the last ingest also answer conditional
+# GETs: ETag and Last-Modified are known without reading any resource rows.
+
+def generation_key(account_id):
+    return f"rmon:generation:{account_id}"
+
+
+def updated_at_key(account_id):
+    return f"rmon:updated_at:{account_id}"
+
+
+def cache_prefix():
+    return f"{settings.CACHE_MIDDLEWARE_KEY_PREFIX}rmon"
+
+
+def new_generation():
+    # Microseconds since the epoch
+    return time.time_ns() // 1000
+
+
+def current_generation(account_id):
+    key = generation_key(account_id)
+    try:
+        generation = cache.get(key)
+        if generation is None:
+            # Evicted or never set; the first process to seed it wins
+            generation = new_generation()
+            cache.add(key, generation, timeout=None)
+            generation = cache.get(key, generation)
+        return generation
+    except Exception:
+        logger.exception("Could not read the rmon cache generation")
+        return None
+
+
+def request_generation(request):
+    # (account, generation) the response of request is cached under, or
+    # None when the cache can't be read
+    scope = request_scope(request)
+    generation = current_generation(scope.account_id)
+    if generation is None:
+        return scope.account_id, None
+    return scope.account_id, f"{scope.generation}.{generation}"
+
+
+def bump_generation(account_id):
+    generation = new_generation()
+    try:
+        cache.set(updated_at_key(account_id), timezone.now(), timeout=None)
+        cache.set(generation_key(account_id), generation, timeout=None)
+        return generation
+    except Exception:
+        logger.exception("Could not bump the rmon cache generation")
+        return None
+
+
+def response_cache_key(request, name, account_id, generation):
+    renderer = getattr(request, 'accepted_renderer', None)
+    media_type = renderer.media_type if renderer else ''
+    path = hashlib.md5(
+        f"{request.get_full_path()}|{media_type}".encode()).hexdigest()
+    return f"{cache_prefix()}:{account_id}:{generation}:{name}:{path}"
+
+
+def generation_cached(handler):
+    # Decorator for DRF handler methods (get). Runs after authentication, so
+    # only permitted requests are answered from the cache.
+    name = handler.__qualname__
+
+    @wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        account_id, generation = request_generation(request)
+        if generation is None:
+            return handler(self, request, *args, **kwargs)
+
+        key = response_cache_key(request, name, account_id, generation)
+        try:
+            cached = cache.get(key)
+        except Exception:
+            logger.exception("Could not read the rmon response cache")
+            cached = None
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+
+        response = handler(self, request, *args, **kwargs)
+        if response.status_code == 200 and hasattr(response, 'add_post_render_callback'):
+            def store(rendered):
+                try:
+                    cache.set(key, (rendered.content, rendered['Content-Type']),
+                              settings.CACHE_MIDDLEWARE_SECONDS)
+                except Exception:
+                    logger.exception("Could not write the rmon response cache")
+            response.add_post_render_callback(store)
+        return response
+
+    return wrapper
+
+
+def generation_etag(request, *args, **kwargs):
+    account_id, generation = request_generation(request)
+    if generation is None:
+        return None
+    renderer = getattr(request, 'accepted_renderer', None)
+    return f'"rmon-{account_id}-{generation}-{renderer.format if renderer else ""}"'
+
+
+def data_last_modified(request, *args, **kwargs):
+    account_id = request_account_id(request)
+    try:
+        updated_at = cache.get(updated_at_key(account_id))
+    except Exception:
+        updated_at = None
+    if updated_at is None:
+        # Cache cleared or never bumped: the cost row of the last ingest
+        updated_at = scoped(CumulativeCost.objects.all(), request_scope(request)) \
+            .aggregate(last=Max('last_updated'))['last']
+    return updated_at
+
+
+# For DRF handler methods (get), above generation_cached: answers
+# If-None-Match / If-Modified-Since with 304 when no ingest ran since
+conditional_get = method_decorator(
+    condition(etag_func=generation_etag, last_modified_func=data_last_modified))
@@ -0,0 +1,89 @@
+import io
+import json
+
+from django.db import connection, models
+from django.db.transaction import TransactionManagementError
+
+# COPY loader for replace-mode ingests on PostgreSQL (RMON_INGEST_LOADER).
+# A batch is streamed into a temporary staging table with COPY FROM STDIN
+# and merged into the resource table with one INSERT ... SELECT ... ON
+# CONFLICT DO UPDATE. That skips the model instances and the multi-row
+# parameterised INSERT the ORM upsert compiles for every batch.
+
+NULL = r'\N'
+
+
+def csv_value(value):
+    # Quoted, so only the unquoted NULL marker reads as NULL
+    if value is None:
+        return NULL
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def converter(field):
+    # Report value -> value in the text form PostgreSQL parses, through the
+    # same preparation the ORM applies on save
+    if isinstance(field, models.JSONField):
+        return lambda value: None if value is None else json.dumps(value, cls=field.encoder)
+    return lambda value: field.get_db_prep_save(value, connection)
+
+
+class CopyLoader:
+
+    def __init__(self):
+        self.staged = set()
+
+    def stage(self, cursor, model):
+        # One staging table per resource table and transaction, with the
+        # table's columns but none of its constraints. The merge empties it.
+        table = model._meta.db_table
+        stage = f"{table}_stage"
+        if stage not in self.staged:
+            columns = ", ".join(connection.ops.quote_name(field.column)
+                                for field in model._meta.concrete_fields
+                                if not field.primary_key)
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE IF NOT EXISTS {connection.ops.quote_name(stage)} "
+                f"ON COMMIT DROP AS SELECT {columns} "
+                f"FROM {connection.ops.quote_name(table)} WITH NO DATA")
+            self.staged.add(stage)
+        return stage
+
+    def upsert(self, model, rows, unique_fields):
+        # rows: dicts of field name (or attname) to value, all with the same
+        # keys; fields they leave out get the model default, as with the
+        # ORM. Returns the primary keys of the inserted or updated rows.
+        # The staging tables live until the transaction ends, so a loader
+        # is only good for the one transaction it was used in.
+        if not connection.in_atomic_block:
+            raise TransactionManagementError("CopyLoader.upsert needs a transaction")
+        fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+        sample = rows[0]
+        names = [field.attname if field.attname in sample else field.name for field in fields]
+        defaults = {name: field.get_default() for name, field in zip(names, fields)
+                    if name not in sample}
+        convert = [converter(field) for field in fields]
+        qn = connection.ops.quote_name
+        columns = ", ".join(qn(field.column) for field in fields)
+        conflict = ", ".join(qn(model._meta.get_field(name).column) for name in unique_fields)
+        updates = ", ".join(f"{qn(field.column)} = EXCLUDED.{qn(field.column)}"
+                            for field in fields if field.name not in unique_fields)
+
+        data = io.StringIO()
+        for row in rows:
+            data.write(",".join(csv_value(prepare(row.get(name, defaults.get(name))))
+                                for name, prepare in zip(names, convert)))
+            data.write("\n")
+        data.seek(0)
+
+        with connection.cursor() as cursor:
+            stage = qn(self.stage(cursor, model))
+            cursor.copy_expert(
+                f"COPY {stage} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '{NULL}')", data)
+            cursor.execute(
+                f"WITH batch AS (DELETE FROM {stage} RETURNING {columns}) "
+                f"INSERT INTO {qn(model._meta.db_table)} ({columns}) "
+                f"SELECT {columns} FROM batch "
+                f"ON CONFLICT ({conflict}) DO UPDATE SET {updates} "
+                f"RETURNING {qn(model._meta.pk.column)}")
+            return [pk for pk, in cursor.fetchall()]
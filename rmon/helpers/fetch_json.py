@@ -1,37 +1,114 @@
-import boto3
-import json
+import gzip
+import ijson
+import zstandard
 
-from botocore.exceptions import ClientError
+from botocore.exceptions import ClientError, IncompleteReadError, ReadTimeoutError, \
+    ResponseStreamingError
 from django.conf import settings
 
-def format_json(raw_json_string):
-    try:
-        body_json = json.loads(raw_json_string)
-        formatted_json = json.dumps(body_json, indent=4)
-        return formatted_json
-    except (json.JSONDecodeError, KeyError) as e:
-        raise ValueError("Failed to format JSON") from e
-
-def fetch_json(aws_access_key_id, aws_secret_access_key,
-               aws_region, bucket_name, object_key):
-    try:
-        session = boto3.Session(
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
-            region_name=aws_region
-        )
+from .aws_clients import get_s3_client
 
-        s3 = session.client('s3')
-        response = s3.get_object(Bucket=bucket_name, Key=object_key)
-        content = response['Body'].read()
-        pretty_json = format_json(content)
+# Returned by open_json when the object still matches the caller's ETag
+NOT_MODIFIED = object()
 
-        return pretty_json,True
+def open_json(aws_access_key_id, aws_secret_access_key,
+              aws_region, bucket_name, object_key,
+              etag=None, last_modified=None):
+    # Returns the get_object response with its unread StreamingBody so the
+    # report can be parsed while it downloads. With etag/last_modified the
+    # request is conditional and an unchanged object costs no download at
+    # all.
+    try:
+        s3 = get_s3_client(aws_access_key_id, aws_secret_access_key, aws_region)
+        params = {'Bucket': bucket_name, 'Key': object_key}
+        if etag:
+            params['IfNoneMatch'] = etag
+        if last_modified:
+            params['IfModifiedSince'] = last_modified
+        response = s3.get_object(**params)
+        return response, True
 
-    except ValueError as e:
-        return (f"Error formatting JSON {str(e)}", False)
     except ClientError as e:
+        if e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') == 304 \
+                or e.response['Error'].get('Code') in ('304', 'NotModified'):
+            return NOT_MODIFIED, True
         error_message = e.response['Error']['Message']
         return ((f"S3 ClientError: {error_message}"), False)
     except Exception as e:
-        return ((f"Error fetching JSON: {str(e)}"),False)
\ No newline at end of file
+        return ((f"Error fetching JSON: {str(e)}"),False)
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+COMPRESSION_SUFFIXES = {
+    '.gz': GZIP,
+    '.gzip': GZIP,
+    '.zst': ZSTD,
+    '.zstd': ZSTD,
+}
+
+DECOMPRESSION_ERRORS = (gzip.BadGzipFile, EOFError, zstandard.ZstdError)
+
+# Reading the S3 body can still fail after the GET succeeded
+DOWNLOAD_ERRORS = (ReadTimeoutError, IncompleteReadError, ResponseStreamingError)
+
+def detect_compression(object_key, content_encoding=None):
+    encoding = (content_encoding or '').strip().lower()
+    if encoding in (GZIP, 'x-gzip'):
+        return GZIP
+    if encoding in (ZSTD, 'zstandard'):
+        return ZSTD
+    for suffix, compression in COMPRESSION_SUFFIXES.items():
+        if object_key.lower().endswith(suffix):
+            return compression
+    return None
+
+def decompressing_reader(fileobj, compression):
+    # Wrap fileobj so reads return decompressed bytes; data is inflated
+    # chunk by chunk as the parser asks for it, never as a whole
+    if compression == GZIP:
+        return gzip.GzipFile(fileobj=fileobj, mode='rb')
+    if compression == ZSTD:
+        return zstandard.ZstdDecompressor().stream_reader(fileobj)
+    return fileobj
+
+def stream_json(fileobj, chunk_size=None):
+    # Single-pass parse of a report read chunk by chunk from fileobj.
+    # Yields the same (section, key, value) events as ingest.iter_report:
+    # one event per resource record, so memory use does not grow with the
+    # size of the report.
+    chunk_size = chunk_size or settings.RMON_STREAM_CHUNK_SIZE
+    depth = 0
+    section = key = None
+    builder = None
+    nesting = 0
+
+    for _, event, value in ijson.parse(fileobj, buf_size=chunk_size, use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            if event in ('start_map', 'start_array'):
+                nesting += 1
+            elif event in ('end_map', 'end_array'):
+                nesting -= 1
+            if nesting == 0:
+                yield section, key if depth >= 2 else None, builder.value
+                builder = None
+            continue
+
+        if event == 'map_key':
+            if depth == 1:
+                section = value
+            else:
+                key = value
+        elif (event == 'start_map' and depth < 2) or \
+                (event == 'start_array' and depth == 2):
+            # Descend into the report, its sections and resource lists
+            depth += 1
+        elif event in ('start_map', 'start_array'):
+            # A single record or value: build it as a whole
+            builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+            nesting = 1
+        elif event in ('end_map', 'end_array'):
+            depth -= 1
+        else:
+            yield section, key if depth >= 2 else None, value
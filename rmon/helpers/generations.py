@@ -0,0 +1,74 @@
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from ..models import IAMUser, S3Bucket, EC2Instance, EBSVolume, RDSSnapshot, \
+    ElasticIP, RDSInstance, EC2Snapshot, Region, SavingsRanking, SavingsSummary, \
+    LiveGeneration
+
+logger = logging.getLogger(__name__)
+
+# Snapshot generations (RMON_SNAPSHOT_GENERATIONS). Every ingest writes the
+# account's rows under a new generation number next to the published one
+# and switches LiveGeneration to it when it commits. Readers resolve the
+# live generation once per request and filter on it, so they see one
+# complete run and never wait on the writer. The previous generation is
+# kept for readers that resolved it just before the switch; older ones
+# and those of failed runs are deleted after the switch.
+#
+# Without the setting every run writes generation 0 in place, readers read
+# generation 0 and the run points LiveGeneration back at it, so turning the
+# setting on again does not serve an older generation; rows of the
+# generations written while it was on stay until the next publish collects
+# them. Turning it off after generation 0 was collected leaves readers with
+# no rows until the next run, which downloads the report again
+# (helpers.refresh.has_ingested_rows).
+
+# Resources before Region, whose deletion would otherwise null their
+# region_ref first
+GENERATION_MODELS = (IAMUser, S3Bucket, EC2Instance, EBSVolume, RDSSnapshot,
+                     ElasticIP, RDSInstance, EC2Snapshot, SavingsRanking,
+                     SavingsSummary, Region)
+
+
+def live_generation(account_id):
+    if not settings.RMON_SNAPSHOT_GENERATIONS:
+        return 0
+    return LiveGeneration.objects.filter(account_id=account_id) \
+        .values_list('generation', flat=True).first() or 0
+
+
+def allocate_generation(account):
+    # The pointer row stays locked until the run commits, so runs of one
+    # account take turns; readers don't lock it
+    LiveGeneration.objects.get_or_create(account=account)
+    LiveGeneration.objects.filter(account=account).update(allocated=F('allocated') + 1)
+    return LiveGeneration.objects.get(account=account).allocated
+
+
+def publish_generation(account, generation):
+    # Switches readers to generation when the current transaction commits
+    # and collects the old ones afterwards
+    pointer, _ = LiveGeneration.objects.select_for_update().get_or_create(account=account)
+    keep = {pointer.generation, generation}
+    pointer.generation = generation
+    pointer.save()
+    # Generations above allocated belong to runs that start after this one
+    transaction.on_commit(lambda: collect_generations(account.pk, keep, pointer.allocated))
+
+
+def reset_generation(account):
+    # Run without generations: generation 0 is the account's report again
+    LiveGeneration.objects.filter(account=account).exclude(generation=0).update(generation=0)
+
+
+def collect_generations(account_id, keep, upto):
+    try:
+        with transaction.atomic():
+            for model in GENERATION_MODELS:
+                model.objects.filter(account_id=account_id, generation__lte=upto) \
+                    .exclude(generation__in=keep).delete()
+    except Exception:
+        logger.exception("Could not delete old generations of account %s", account_id)
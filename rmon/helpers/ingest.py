@@ -0,0 +1,620 @@
+import heapq
+from collections import Counter, defaultdict, namedtuple
+from datetime import datetime, timezone as dt_timezone
+from functools import partial
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from credman.models import AWSAccountCredentials
+
+from .cache import bump_generation
+from .copy_loader import CopyLoader
+from .generations import allocate_generation, publish_generation, reset_generation
+from ..models import IAMUser, S3Bucket, EC2Instance, \
+EBSVolume, RDSSnapshot, ElasticIP, \
+Region, RDSInstance, EC2Snapshot, Project, \
+CumulativeCost, CumulativeCostHistory, RegionDocument, SavingsRanking, SavingsSummary
+
+META_KEYS = ("account_id", "project_name")
+COST_KEY = "CumulativeCostOptimization"
+
+REPLACE = "replace"
+INCREMENTAL = "incremental"
+SYNC_MODES = (REPLACE, INCREMENTAL)
+
+# How regional resources are tied to their Region (RMON_REGION_SCHEMA)
+M2M = "m2m"
+FK = "fk"
+REGION_SCHEMAS = (M2M, FK)
+
+# How replace-mode batches are written (RMON_INGEST_LOADER)
+ORM = "orm"
+COPY = "copy"
+LOADERS = (ORM, COPY)
+
+# name: key used in API responses, report_key: list name in the report,
+# relation: Region m2m and response key (None for global resources),
+# natural_key: unique field used for upserts
+ResourceType = namedtuple(
+    'ResourceType', ['name', 'report_key', 'model', 'relation', 'natural_key', 'build'])
+
+
+def parse_savings(value):
+    return value.split(" ")[0]
+
+
+def build_iam_user(user):
+    return {
+        "user_id": user["UserId"],
+        "user_name": user["UserName"],
+        "tags": user["Tags"],
+        "last_login": user["LastLogin"]
+    }
+
+
+def build_s3_bucket(bucket):
+    return {
+        "bucket_name": bucket["BucketName"],
+        "creation_date": bucket["CreationDate"],
+        "tags": bucket["Tags"],
+        "status": bucket["Status"],
+    }
+
+
+def build_ec2_instance(ec2_instance):
+    return {
+        "instance_id": ec2_instance["InstanceId"],
+        "instance_type": ec2_instance["InstanceType"],
+        "launch_time": ec2_instance["LaunchTime"],
+        "region": ec2_instance["Region"],
+        "age": ec2_instance["Age"],
+        "tags": ec2_instance["Tags"],
+        "status": ec2_instance["Status"],
+        "potential_cost_savings": parse_savings(ec2_instance["PotentialCostSavings"]),
+        "recommendations": ec2_instance["Recommendations"]
+    }
+
+
+def build_rds_instance(rds_instance):
+    return {
+        "db_instance_identifier": rds_instance["DBInstanceIdentifier"],
+        "db_instance_class": rds_instance["DBInstanceClass"],
+        "backup_type": rds_instance["BackupType"],
+        "region": rds_instance["Region"],
+        "potential_cost_savings": parse_savings(rds_instance["PotentialCostSavings"]),
+        "recommendations": rds_instance["Recommendations"]
+    }
+
+
+def build_ebs_volume(ebs_volume):
+    return {
+        "volume_id": ebs_volume["VolumeId"],
+        "size": ebs_volume["Size"],
+        "region": ebs_volume["Region"],
+        "tags": ebs_volume["Tags"],
+        "potential_cost_savings": parse_savings(ebs_volume["PotentialCostSavings"]),
+        "recommendations": ebs_volume["Recommendations"]
+    }
+
+
+def build_rds_snapshot(rds_snapshot):
+    return {
+        "snapshot_id": rds_snapshot["SnapshotId"],
+        "creation_date": rds_snapshot["CreationDate"],
+        "region": rds_snapshot["Region"],
+        "potential_cost_savings": parse_savings(rds_snapshot["PotentialCostSavings"]),
+        "recommendations": rds_snapshot["Recommendations"]
+    }
+
+
+def build_ec2_snapshot(ec2_snapshot):
+    return {
+        "snapshot_id": ec2_snapshot["SnapshotId"],
+        "creation_date": ec2_snapshot["StartTime"],
+        "region": ec2_snapshot["Region"],
+        "potential_cost_savings": parse_savings(ec2_snapshot["PotentialCostSavings"]),
+        "recommendations": ec2_snapshot["Recommendations"]
+    }
+
+
+def build_elastic_ip(elastic_ip):
+    return {
+        "allocation_id": elastic_ip["AllocationId"],
+        "public_ip": elastic_ip["PublicIp"],
+        "region": elastic_ip["Region"],
+        "tags": elastic_ip["Tags"],
+        "potential_cost_savings": parse_savings(elastic_ip["PotentialCostSavings"]),
+        "recommendations": elastic_ip["Recommendations"],
+    }
+
+
+GLOBAL_TYPES = {
+    rtype.report_key: rtype for rtype in (
+        ResourceType("iam_users", "IAMUsers", IAMUser, None, "user_id", build_iam_user),
+        ResourceType("s3_buckets", "S3Buckets", S3Bucket, None, "bucket_name", build_s3_bucket),
+    )
+}
+
+RESOURCE_TYPES = {
+    rtype.report_key: rtype for rtype in (
+        ResourceType("ec2_instances", "StoppedEC2Instances", EC2Instance,
+                     "stopped_ec2_instances", "instance_id", build_ec2_instance),
+        ResourceType("rds_instances", "UnusedRDSInstances", RDSInstance,
+                     "unused_rds_instances", "db_instance_identifier", build_rds_instance),
+        ResourceType("ebs_volumes", "AvailableEBSVolumes", EBSVolume,
+                     "available_ebs_volumes", "volume_id", build_ebs_volume),
+        ResourceType("rds_snapshots", "OldRDSSnapshots", RDSSnapshot,
+                     "old_rds_snapshots", "snapshot_id", build_rds_snapshot),
+        ResourceType("ec2_snapshots", "OldEBSSnapshots", EC2Snapshot,
+                     "old_ec2_snapshots", "snapshot_id", build_ec2_snapshot),
+        ResourceType("elastic_ips", "AvailableElasticIPs", ElasticIP,
+                     "unused_elastic_ips", "allocation_id", build_elastic_ip),
+    )
+}
+
+# Creation date of the regional types that have one, for SavingsSummary
+CREATED_FIELDS = {
+    "ec2_instances": "launch_time",
+    "rds_snapshots": "creation_date",
+    "ec2_snapshots": "creation_date",
+}
+
+
+def iter_report(json_data):
+    # Flatten a parsed report into (section, key, value) events; one event
+    # per resource record so the ingest never needs the whole list at once
+    for section, payload in json_data.items():
+        if section in META_KEYS:
+            yield section, None, payload
+            continue
+        for key, value in payload.items():
+            if isinstance(value, list):
+                for record in value:
+                    yield section, key, record
+            else:
+                yield section, key, value
+
+
+def upsert(model, objs, natural_key, batch_size):
+    # Conflicts on the (account, generation, natural key) constraint
+    unique_fields = ['account', 'generation', natural_key]
+    update_fields = [field.name for field in model._meta.concrete_fields
+                     if not field.primary_key and field.name not in unique_fields]
+    model.objects.bulk_create(
+        objs,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=unique_fields,
+        update_fields=update_fields,
+    )
+
+
+def link_columns(relation):
+    # Through model of a Region relation and its region / resource columns
+    field = Region._meta.get_field(relation)
+    return (field.remote_field.through,
+            f"{field.m2m_field_name()}_id",
+            f"{field.m2m_reverse_field_name()}_id")
+
+
+def region_fk():
+    # m2m: the six Region many-to-many tables, one link row per resource;
+    # fk: the indexed region_ref column of the resource itself
+    if settings.RMON_REGION_SCHEMA not in REGION_SCHEMAS:
+        raise ValueError(f"Unknown RMON_REGION_SCHEMA {settings.RMON_REGION_SCHEMA!r}")
+    return settings.RMON_REGION_SCHEMA == FK
+
+
+def copy_loader():
+    # COPY needs PostgreSQL; everything else keeps the ORM upsert
+    if settings.RMON_INGEST_LOADER not in LOADERS:
+        raise ValueError(f"Unknown RMON_INGEST_LOADER {settings.RMON_INGEST_LOADER!r}")
+    if settings.RMON_INGEST_LOADER == COPY and connection.vendor == 'postgresql':
+        return CopyLoader()
+    return None
+
+
+def region_resources(region, rtype):
+    # Resources of one type in a region (instance or pk), unordered
+    if region_fk():
+        return rtype.model.objects.filter(region_ref=region)
+    lookup = Region._meta.get_field(rtype.relation).related_query_name()
+    return rtype.model.objects.filter(**{lookup: region})
+
+
+def normalize(model, name, value):
+    # Bring a report value to the type the database hands back so unchanged
+    # rows compare equal
+    value = model._meta.get_field(name).to_python(value)
+    if isinstance(value, datetime) and timezone.is_naive(value):
+        value = timezone.make_aware(value, dt_timezone.utc)
+    return value
+
+
+def batched(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class ReportIngest:
+    # Buffers report records per (section, resource type) and writes them
+    # in batches instead of several round trips per resource.
+    #
+    # replace: upsert every record and rebuild the region links, the old
+    # clear-and-reinsert behaviour. On PostgreSQL the upserts go through
+    # COPY and a staging table unless RMON_INGEST_LOADER is orm.
+    # incremental: diff each batch against the stored rows by natural key,
+    # insert new rows, update changed fields only and, at the end, delete
+    # rows and links that are no longer in the report.
+    #
+    # With RMON_SNAPSHOT_GENERATIONS the run writes a new generation and
+    # publishes it in finish (helpers.generations); always replace mode.
+
+    def __init__(self, user, batch_size=None, mode=None, account=None):
+        self.user = user
+        # Every row written belongs to the user's account and only that
+        # account's rows are replaced, pruned or locked
+        self.account = account or AWSAccountCredentials.objects.get(user=user)
+        self.batch_size = batch_size or settings.RMON_INGEST_BATCH_SIZE
+        self.mode = mode or settings.RMON_SYNC_MODE
+        self.region_fk = region_fk()
+        if self.mode not in SYNC_MODES:
+            raise ValueError(f"Unknown sync mode: {self.mode}")
+        self.generations = settings.RMON_SNAPSHOT_GENERATIONS
+        if self.generations:
+            # A new generation starts empty, there is nothing to diff against
+            self.mode = REPLACE
+        self.generation = 0
+        self.loader = copy_loader()
+        self.meta = {}
+        self.cost = {}
+        self.pending = {}
+        self.regions = {}
+        self.stats = Counter()
+        # incremental mode only
+        self.existing = {}
+        self.seen = defaultdict(set)
+        self.links = {}
+        self.linked = defaultdict(set)
+        self.changes = defaultdict(lambda: Counter(added=0, changed=0, removed=0))
+        # min-heap of the largest savings seen, for SavingsRanking, and its
+        # entry per (type, id)
+        self.ranking_size = settings.RMON_SAVINGS_RANKING_SIZE
+        self.top = []
+        self.ranked = {}
+        # (region, type name): (count, total savings, max savings, oldest
+        # creation date), for SavingsSummary
+        self.summary = {}
+
+    @property
+    def incremental(self):
+        return self.mode == INCREMENTAL
+
+    def resource_types(self):
+        return list(GLOBAL_TYPES.values()) + list(RESOURCE_TYPES.values())
+
+    def begin(self):
+        if self.generations:
+            self.generation = allocate_generation(self.account)
+        if not self.incremental:
+            for rtype in GLOBAL_TYPES.values():
+                self.rows(rtype).delete()
+            return
+        for rtype in self.resource_types():
+            self.existing[rtype.name] = set(
+                self.rows(rtype).values_list(rtype.natural_key, flat=True))
+            self.changes[rtype.name] = Counter(added=0, changed=0, removed=0)
+
+    def rows(self, rtype):
+        return rtype.model.objects.filter(account=self.account, generation=self.generation)
+
+    def new(self, model, row):
+        return model(account=self.account, generation=self.generation, **row)
+
+    def feed(self, section, key, value):
+        if section in META_KEYS:
+            self.meta[section] = value
+            return
+        if section == "global":
+            if key == COST_KEY:
+                self.cost = value
+                return
+            rtype = GLOBAL_TYPES.get(key)
+        else:
+            self.region(section)
+            rtype = RESOURCE_TYPES.get(key)
+        if rtype is None:
+            return
+
+        batch = self.pending.setdefault((section, key), [])
+        batch.append(rtype.build(value))
+        if len(batch) >= self.batch_size:
+            self.flush(section, rtype)
+
+    def region(self, name):
+        region = self.regions.get(name)
+        if region is None:
+            region, _ = Region.objects.get_or_create(
+                account=self.account, generation=self.generation, name=name)
+            self.regions[name] = region
+            if self.region_fk:
+                if not self.incremental:
+                    # Detach the region's previous resources, the rows in
+                    # the report are attached again as they are written
+                    for rtype in RESOURCE_TYPES.values():
+                        self.rows(rtype).filter(region_ref=region).update(region_ref=None)
+                return region
+            for rtype in RESOURCE_TYPES.values():
+                through, source, target = link_columns(rtype.relation)
+                links = through.objects.filter(**{source: region.pk})
+                if self.incremental:
+                    self.links[(name, rtype.relation)] = set(
+                        links.values_list(target, flat=True))
+                else:
+                    # Drop the region's previous links, they are rebuilt below
+                    links.delete()
+        return region
+
+    def flush(self, section, rtype):
+        rows = self.pending.pop((section, rtype.report_key), [])
+        if not rows:
+            return
+        # Keep the last record per natural key, an upsert cannot touch
+        # the same row twice in one statement
+        rows = list({row[rtype.natural_key]: row for row in rows}.values())
+        if rtype.relation and self.region_fk:
+            for row in rows:
+                row["region_ref_id"] = self.regions[section].pk
+        if self.incremental:
+            pks = self.sync_rows(rtype, rows)
+        elif self.loader is not None:
+            pks = self.loader.upsert(
+                rtype.model,
+                [{**row, "account_id": self.account.pk, "generation": self.generation}
+                 for row in rows],
+                ['account', 'generation', rtype.natural_key])
+        else:
+            objs = [self.new(rtype.model, row) for row in rows]
+            upsert(rtype.model, objs, rtype.natural_key, self.batch_size)
+            pks = [obj.pk for obj in objs]
+        self.stats[rtype.name] += len(rows)
+
+        if rtype.relation:
+            if not self.region_fk:
+                self.link(section, rtype.relation, pks)
+            self.rank(rtype, rows)
+            self.summarize(section, rtype, rows)
+
+    def sync_rows(self, rtype, rows):
+        model, natural_key = rtype.model, rtype.natural_key
+        pk_name = model._meta.pk.attname
+        keys = [row[natural_key] for row in rows]
+        self.seen[rtype.name].update(keys)
+        current = {
+            values[natural_key]: values for values in self.rows(rtype).filter(
+                **{f"{natural_key}__in": keys}).values()
+        }
+
+        pks, added, changed, changed_fields = [], [], [], set()
+        for row in rows:
+            values = current.get(row[natural_key])
+            if values is None:
+                added.append(self.new(model, row))
+                continue
+            diff = [name for name, value in row.items()
+                    if normalize(model, name, value) != values[name]]
+            if diff:
+                changed.append(model(**{pk_name: values[pk_name]}, **row))
+                changed_fields.update(diff)
+            pks.append(values[pk_name])
+
+        if added:
+            model.objects.bulk_create(added, batch_size=self.batch_size)
+            pks.extend(obj.pk for obj in added)
+        if changed:
+            model.objects.bulk_update(changed, sorted(changed_fields),
+                                      batch_size=self.batch_size)
+        self.changes[rtype.name]["added"] += len(added)
+        self.changes[rtype.name]["changed"] += len(changed)
+        return pks
+
+    def rank(self, rtype, rows):
+        for row in rows:
+            self.push_ranked((float(row["potential_cost_savings"]), rtype.name,
+                              row[rtype.natural_key], row["region"], row["recommendations"]))
+
+    def push_ranked(self, item):
+        # A resource listed twice (in two regions, say) keeps one entry, the
+        # one with the larger savings, so duplicates never take up places
+        key = item[1:3]
+        current = self.ranked.get(key)
+        if current is not None:
+            if item > current:
+                self.top[self.top.index(current)] = item
+                heapq.heapify(self.top)
+                self.ranked[key] = item
+            return
+        if len(self.top) < self.ranking_size:
+            heapq.heappush(self.top, item)
+        elif item > self.top[0]:
+            del self.ranked[heapq.heapreplace(self.top, item)[1:3]]
+        else:
+            return
+        self.ranked[key] = item
+
+    def summarize(self, section, rtype, rows):
+        savings = [float(row["potential_cost_savings"]) for row in rows]
+        created = CREATED_FIELDS.get(rtype.name)
+        dates = [normalize(rtype.model, created, row[created])
+                 for row in rows if row[created]] if created else []
+        self.add_summary((section, rtype.name), len(rows), sum(savings),
+                         max(savings), min(dates, default=None))
+
+    def add_summary(self, key, count, total, largest, oldest):
+        current = self.summary.get(key)
+        if current is not None:
+            count, total = count + current[0], total + current[1]
+            largest = max(largest, current[2])
+            if oldest is None or (current[3] is not None and current[3] < oldest):
+                oldest = current[3]
+        self.summary[key] = (count, total, largest, oldest)
+
+    def link(self, section, relation, pks):
+        through, source, target = link_columns(relation)
+        region = self.regions[section]
+        if self.incremental:
+            linked = self.links[(section, relation)]
+            self.linked[(section, relation)].update(pks)
+            pks = [pk for pk in pks if pk not in linked]
+        through.objects.bulk_create(
+            [through(**{source: region.pk, target: pk}) for pk in pks],
+            batch_size=self.batch_size,
+            ignore_conflicts=True,
+        )
+
+    def prune(self):
+        # Remove links and rows that the report no longer mentions
+        for (section, relation), linked in self.links.items():
+            through, source, target = link_columns(relation)
+            stale = linked - self.linked[(section, relation)]
+            for chunk in batched(stale, self.batch_size):
+                through.objects.filter(**{source: self.regions[section].pk,
+                                          f"{target}__in": chunk}).delete()
+
+        for rtype in self.resource_types():
+            gone = self.existing[rtype.name] - self.seen[rtype.name]
+            for chunk in batched(gone, self.batch_size):
+                self.rows(rtype).filter(
+                    **{f"{rtype.natural_key}__in": chunk}).delete()
+            self.changes[rtype.name]["removed"] += len(gone)
+
+    def flush_all(self):
+        for (section, key) in list(self.pending):
+            rtype = GLOBAL_TYPES.get(key) if section == "global" else RESOURCE_TYPES.get(key)
+            self.flush(section, rtype)
+
+    def finish(self):
+        self.flush_all()
+        if self.incremental:
+            self.prune()
+
+        update_cumulative_cost(self.cost, self.account)
+        update_project_data(self.user, self.meta)
+        update_savings_ranking(self.top, self.ranking_size, self.account, self.generation)
+        update_savings_summary(self.summary, self.account, self.generation)
+        if self.generations:
+            publish_generation(self.account, self.generation)
+        else:
+            reset_generation(self.account)
+        # Region documents are rendered again once this run committed (in a
+        # parallel ingest the worker rows are not visible before that)
+        RegionDocument.objects.filter(region__account=self.account,
+                                      region__generation=self.generation).delete()
+        if settings.RMON_REGION_DOCUMENTS:
+            from .regions import render_region_documents
+            transaction.on_commit(partial(render_region_documents, self.account.pk))
+        # Cached read responses of this account become stale once this run
+        # commits
+        transaction.on_commit(partial(bump_generation, self.account.pk))
+
+        summary = {"mode": self.mode, "counts": dict(self.stats)}
+        if self.incremental:
+            summary["changes"] = {name: dict(counts)
+                                  for name, counts in self.changes.items()}
+        return summary
+
+
+def update_project_data(user, meta):
+    # Clear existing project records for the user
+    Project.objects.filter(user=user).delete()
+    Project.objects.create(
+        user=user,
+        project_name=meta["project_name"],
+        account_id=meta["account_id"]
+    )
+
+
+def update_cumulative_cost(cumulative_cost_data, account):
+    # Extract cumulative costs
+    ec2_cost = cumulative_cost_data.get("EC2", "0.00 USD").replace(" USD", "")
+    rds_cost = cumulative_cost_data.get("RDS", "0.00 USD").replace(" USD", "")
+    ebs_cost = cumulative_cost_data.get("EBS", "0.00 USD").replace(" USD", "")
+    rds_snapshots_cost = cumulative_cost_data.get("RDSSnapshots", "0.00 USD").replace(" USD", "")
+    ebs_snapshots_cost = cumulative_cost_data.get("EBSSnapshots", "0.00 USD").replace(" USD", "")
+    elastic_ips_cost = cumulative_cost_data.get("ElasticIPs", "0.00 USD").replace(" USD", "")
+
+    # Save current cost to history
+    CumulativeCostHistory.objects.create(
+        account=account,
+        ec2_cost=ec2_cost,
+        rds_cost=rds_cost,
+        ebs_cost=ebs_cost,
+        rds_snapshots_cost=rds_snapshots_cost,
+        ebs_snapshots_cost=ebs_snapshots_cost,
+        elastic_ips_cost=elastic_ips_cost
+    )
+
+    # Update latest cumulative cost
+    CumulativeCost.objects.update_or_create(
+        account=account,
+        defaults={
+            'ec2_cost': ec2_cost,
+            'rds_cost': rds_cost,
+            'ebs_cost': ebs_cost,
+            'rds_snapshots_cost': rds_snapshots_cost,
+            'ebs_snapshots_cost': ebs_snapshots_cost,
+            'elastic_ips_cost': elastic_ips_cost
+        }
+    )
+
+
+def update_savings_ranking(candidates, size, account, generation=0):
+    # candidates: (savings, type, id, region, recommendations) tuples, one
+    # per (type, id)
+    ranking = []
+    for savings, name, key, region, recommendations in sorted(candidates, reverse=True):
+        ranking.append(SavingsRanking(
+            account=account, generation=generation, rank=len(ranking) + 1,
+            resource_type=name, resource_id=key,
+            region=region, potential_cost_savings=savings,
+            recommendations=recommendations))
+        if len(ranking) >= size:
+            break
+    SavingsRanking.objects.filter(account=account, generation=generation).delete()
+    SavingsRanking.objects.bulk_create(ranking)
+
+
+def update_savings_summary(summary, account, generation=0):
+    SavingsSummary.objects.filter(account=account, generation=generation).delete()
+    SavingsSummary.objects.bulk_create([
+        SavingsSummary(account=account, generation=generation, region=region,
+                       resource_type=name, resource_count=count,
+                       total_savings=round(total, 2), max_savings=largest,
+                       oldest_created=oldest)
+        for (region, name), (count, total, largest, oldest) in sorted(summary.items())
+    ])
+
+
+def ingest_events(events, user, batch_size=None, mode=None, workers=None):
+    workers = settings.RMON_INGEST_WORKERS if workers is None else workers
+    if workers > 1 and connection.vendor == 'postgresql':
+        from .parallel import parallel_ingest_events
+        return parallel_ingest_events(events, user, workers,
+                                      batch_size=batch_size, mode=mode)
+
+    # The whole refresh is one transaction: readers keep seeing the previous
+    # data until it commits and a failure leaves the tables untouched
+    with transaction.atomic():
+        ingest = ReportIngest(user, batch_size=batch_size, mode=mode)
+        ingest.begin()
+        for section, key, value in events:
+            ingest.feed(section, key, value)
+        return ingest.finish()
+
+
+def ingest_report(json_data, user, batch_size=None, mode=None, workers=None):
+    return ingest_events(iter_report(json_data), user,
+                         batch_size=batch_size, mode=mode, workers=workers)
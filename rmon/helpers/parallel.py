@@ -0,0 +1,185 @@
+import queue
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+
+from .ingest import ReportIngest, META_KEYS
+
+# Parallel ingest: regions are spread over worker threads, each with its own
+# database connection and one open transaction. Workers write their regions,
+# then wait for the coordinator. Only when every worker and the coordinator
+# (global resources, pruning, costs) succeeded are the transactions
+# committed, workers first and the coordinator last; any failure rolls all
+# of them back. This is a coordinated commit, not two-phase commit: a
+# commit failing after others went through can still leave a partial run.
+# With RMON_SNAPSHOT_GENERATIONS such a run is never read: worker rows
+# belong to a generation that only the coordinator's commit publishes.
+
+POLL_INTERVAL = 0.5
+
+
+class IngestAborted(Exception):
+    pass
+
+
+class RegionWorker(threading.Thread):
+
+    def __init__(self, coordinator):
+        super().__init__(daemon=True)
+        self.coordinator = coordinator
+        self.inbox = queue.Queue(maxsize=settings.RMON_INGEST_QUEUE_SIZE)
+        self.ready = threading.Event()
+        self.ingest = ReportIngest(coordinator.user,
+                                   batch_size=coordinator.batch_size,
+                                   mode=coordinator.mode,
+                                   account=coordinator.account)
+        self.error = None
+        self.committed = False
+
+    def put(self, item):
+        while True:
+            self.check()
+            try:
+                self.inbox.put(item, timeout=POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+    def check(self):
+        if self.error is not None:
+            raise RuntimeError(f"Region worker failed: {self.error}") from self.error
+        if self.ready.is_set() and not self.is_alive():
+            raise RuntimeError("Region worker exited early")
+
+    def next_item(self):
+        while True:
+            if self.coordinator.aborted.is_set():
+                raise IngestAborted()
+            try:
+                return self.inbox.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue
+
+    def run(self):
+        try:
+            with transaction.atomic():
+                if connection.vendor == 'postgresql':
+                    # Two workers waiting on each other's rows would otherwise
+                    # hang until the coordinator gives up
+                    with connection.cursor() as cursor:
+                        cursor.execute("SET LOCAL lock_timeout = %s",
+                                       [settings.RMON_INGEST_LOCK_TIMEOUT])
+                while True:
+                    item = self.next_item()
+                    if item is None:
+                        break
+                    section, records = item
+                    for key, value in records:
+                        self.ingest.feed(section, key, value)
+                self.ingest.flush_all()
+
+                self.ready.set()
+                self.coordinator.decided.wait()
+                if not self.coordinator.commit:
+                    raise IngestAborted()
+            self.committed = True
+        except IngestAborted:
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            self.ready.set()
+            connections.close_all()
+
+
+class ParallelReportIngest(ReportIngest):
+
+    def __init__(self, user, workers, batch_size=None, mode=None):
+        super().__init__(user, batch_size=batch_size, mode=mode)
+        self.decided = threading.Event()
+        self.aborted = threading.Event()
+        self.commit = False
+        self.workers = [RegionWorker(self) for _ in range(workers)]
+        self.routes = {}
+        self.buffers = defaultdict(list)
+
+    def begin(self):
+        super().begin()
+        for worker in self.workers:
+            worker.ingest.generation = self.generation
+            worker.start()
+
+    def feed(self, section, key, value):
+        if section in META_KEYS or section == "global":
+            super().feed(section, key, value)
+            return
+        buffer = self.buffers[section]
+        buffer.append((key, value))
+        if len(buffer) >= self.batch_size:
+            self.send(section)
+
+    def send(self, section):
+        worker = self.routes.get(section)
+        if worker is None:
+            # Every record of a region goes to the same worker
+            worker = self.workers[len(self.routes) % len(self.workers)]
+            self.routes[section] = worker
+        worker.put((section, self.buffers.pop(section, [])))
+
+    def finish(self):
+        for section in list(self.buffers):
+            self.send(section)
+        for worker in self.workers:
+            worker.put(None)
+        for worker in self.workers:
+            worker.ready.wait()
+            worker.check()
+
+        for worker in self.workers:
+            region_ingest = worker.ingest
+            self.stats.update(region_ingest.stats)
+            self.regions.update(region_ingest.regions)
+            self.links.update(region_ingest.links)
+            for name, keys in region_ingest.seen.items():
+                self.seen[name].update(keys)
+            for link, pks in region_ingest.linked.items():
+                self.linked[link].update(pks)
+            for name, counts in region_ingest.changes.items():
+                self.changes[name].update(counts)
+            for item in region_ingest.top:
+                self.push_ranked(item)
+            for key, values in region_ingest.summary.items():
+                self.add_summary(key, *values)
+        return super().finish()
+
+    def close(self, commit):
+        if self.decided.is_set():
+            return
+        self.commit = commit
+        if not commit:
+            self.aborted.set()
+        self.decided.set()
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.join()
+        if commit:
+            for worker in self.workers:
+                if not worker.committed:
+                    raise RuntimeError(
+                        f"Region worker failed to commit: {worker.error}")
+
+
+def parallel_ingest_events(events, user, workers, batch_size=None, mode=None):
+    ingest = ParallelReportIngest(user, workers, batch_size=batch_size, mode=mode)
+    try:
+        with transaction.atomic():
+            ingest.begin()
+            for section, key, value in events:
+                ingest.feed(section, key, value)
+            summary = ingest.finish()
+            ingest.close(commit=True)
+        return summary
+    finally:
+        ingest.close(commit=False)
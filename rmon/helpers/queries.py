@@ -0,0 +1,55 @@
+from datetime import timedelta
+
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce, TruncDay, TruncHour, TruncMonth, TruncWeek
+
+from .ingest import RESOURCE_TYPES, link_columns, region_fk
+
+
+def count_attr(name):
+    return f"{name}_count"
+
+
+def link_count(relation):
+    # Correlated COUNT over one Region relation's through table. Unlike
+    # Count() over several m2m joins this doesn't multiply rows, and it is
+    # answered from the through table's region index.
+    through, source, _ = link_columns(relation)
+    counts = through.objects.filter(**{source: OuterRef('pk')}).order_by() \
+        .values(source).annotate(count=Count('*')).values('count')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def ref_count(model):
+    # Same over the resource table's region_ref index (RMON_REGION_SCHEMA fk)
+    counts = model.objects.filter(region_ref=OuterRef('pk')).order_by() \
+        .values('region_ref').annotate(count=Count('*')).values('count')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def with_resource_counts(regions):
+    # Annotate <name>_count for each resource type, in the same query
+    fk = region_fk()
+    return regions.annotate(**{
+        count_attr(rtype.name): ref_count(rtype.model) if fk else link_count(rtype.relation)
+        for rtype in RESOURCE_TYPES.values()
+    })
+
+
+COST_FIELDS = ('ec2_cost', 'rds_cost', 'ebs_cost',
+               'rds_snapshots_cost', 'ebs_snapshots_cost', 'elastic_ips_cost')
+
+# bucket name: (truncation, bucket length)
+COST_BUCKETS = {
+    'hour': (TruncHour, timedelta(hours=1)),
+    'day': (TruncDay, timedelta(days=1)),
+    'week': (TruncWeek, timedelta(weeks=1)),
+    'month': (TruncMonth, timedelta(days=28)),
+}
+
+
+def bucket_count(start, end, bucket):
+    # Upper bound on the number of buckets a range can produce
+    span = COST_BUCKETS[bucket][1]
+    return (end - start) // span + 2
+
@@ -0,0 +1,209 @@
+import json
+import logging
+import time
+
+import ijson
+
+from django.conf import settings
+from rest_framework import status
+
+from credman.models import AWSAccountCredentials as aac
+
+from .fetch_json import NOT_MODIFIED, open_json, stream_json, \
+    detect_compression, decompressing_reader, DECOMPRESSION_ERRORS, DOWNLOAD_ERRORS
+from .generations import live_generation
+from .ingest import ingest_events, ingest_report
+from .snapshot_store import SnapshotWriter, record_snapshot
+from ..models import IAMUser, IngestJob, Region, S3Bucket
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("fetch", "store", "parse", "ingest")
+
+
+class JobProgress:
+    # Records per-stage state on an IngestJob; a no-op without a job so the
+    # synchronous refresh can share the same pipeline
+
+    def __init__(self, job=None):
+        self.job = job
+        self.started = {}
+        self.progress = {stage: {"state": "pending"} for stage in STAGES}
+
+    def start(self, stage):
+        self.started[stage] = time.monotonic()
+        self.progress[stage] = {"state": "running"}
+        self.save(stage)
+
+    def done(self, stage, **info):
+        elapsed = time.monotonic() - self.started.get(stage, time.monotonic())
+        self.progress[stage] = {"state": "done", "elapsed": round(elapsed, 3), **info}
+        self.save(stage)
+
+    def skip(self, stage):
+        self.progress[stage] = {"state": "skipped"}
+        self.save(stage)
+
+    def fail(self, stage, error):
+        self.progress[stage] = {"state": "failed", "error": error}
+        self.save(stage)
+
+    def save(self, stage):
+        if self.job is not None:
+            IngestJob.objects.filter(pk=self.job.pk).update(
+                stage=stage, progress=self.progress)
+
+
+class TeeReader:
+    # File-like wrapper that copies every chunk read from source into sink
+
+    def __init__(self, source, sink):
+        self.source = source
+        self.sink = sink
+        self.size = 0
+
+    def read(self, size=-1):
+        chunk = self.source.read(size)
+        self.sink.write(chunk)
+        self.size += len(chunk)
+        return chunk
+
+
+def run_refresh(user, progress=None, force=False, mode=None):
+    # Fetch the user's report from S3 and load it into the rmon tables.
+    # Returns (payload, http_status) like the synchronous endpoint does.
+    progress = progress or JobProgress()
+
+    try:
+        # Retrieve AWS credentials for the user from the credman app
+        aws_credentials = aac.objects.get(user=user)
+    except aac.DoesNotExist:
+        return ({"error": "No AWS credentials found for the user."},
+                status.HTTP_400_BAD_REQUEST)
+
+    progress.start("fetch")
+    conditional = not force and has_ingested_rows(aws_credentials)
+    (response, fetch_status) = open_json(
+        aws_credentials.aws_access_key_id,
+        aws_credentials.aws_secret_access_key,
+        aws_credentials.aws_region,
+        aws_credentials.bucket_name,
+        aws_credentials.object_key,
+        etag=aws_credentials.report_etag if conditional else None,
+        last_modified=aws_credentials.report_last_modified if conditional else None)
+    if not fetch_status:
+        progress.fail("fetch", response)
+        return {"data": response}, status.HTTP_401_UNAUTHORIZED
+
+    if response is NOT_MODIFIED:
+        progress.done("fetch", not_modified=True)
+        for stage in STAGES[1:]:
+            progress.skip(stage)
+        return ({"message": "Report unchanged since the last refresh.",
+                 "not_modified": True}, status.HTTP_200_OK)
+    compression = detect_compression(aws_credentials.object_key,
+                                     response.get('ContentEncoding'))
+    progress.done("fetch", size=response.get('ContentLength'),
+                  compression=compression)
+
+    body = decompressing_reader(response['Body'], compression)
+    try:
+        if settings.RMON_INGEST_STREAMING:
+            payload, http_status = stream_ingest(user, aws_credentials, body, progress, mode)
+        else:
+            payload, http_status = buffered_ingest(user, aws_credentials, body, progress, mode)
+    finally:
+        response['Body'].close()
+
+    if http_status == status.HTTP_200_OK:
+        aac.objects.filter(pk=aws_credentials.pk).update(
+            report_etag=response.get('ETag', ''),
+            report_last_modified=response.get('LastModified'))
+    return payload, http_status
+
+
+def has_ingested_rows(aws_credentials):
+    # The stored ETag only says the report was ingested once. If readers of
+    # the account see no rows (purged after the upgrade to account scoping,
+    # or a collected generation), the report is downloaded again whatever
+    # S3 would answer. A report without any resource is always downloaded.
+    generation = live_generation(aws_credentials.pk)
+    return any(model.objects.filter(account=aws_credentials, generation=generation).exists()
+               for model in (Region, IAMUser, S3Bucket))
+
+
+def buffered_ingest(user, account, body, progress, mode=None):
+    progress.start("parse")
+    try:
+        raw = body.read()
+        json_data = json.loads(raw)
+    except ValueError as e:
+        progress.fail("parse", str(e))
+        return ({"data": f"Error formatting JSON {str(e)}"},
+                status.HTTP_401_UNAUTHORIZED)
+    except DECOMPRESSION_ERRORS as e:
+        progress.fail("parse", str(e))
+        return ({"data": f"Error decompressing report {str(e)}"},
+                status.HTTP_401_UNAUTHORIZED)
+    except DOWNLOAD_ERRORS as e:
+        return download_failed(progress, e)
+    progress.done("parse")
+
+    progress.start("ingest")
+    summary = ingest_report(json_data, user, mode=mode)
+    progress.done("ingest", **summary)
+
+    progress.start("store")
+    with SnapshotWriter() as writer:
+        writer.write(raw)
+        snapshot = store_snapshot(account, writer, progress)
+
+    return ({"message": "Data saved successfully.", **summary,
+             "snapshot": snapshot and snapshot.digest}, status.HTTP_200_OK)
+
+
+def stream_ingest(user, account, body, progress, mode=None):
+    # Download, parse and ingest in one pass over the S3 body; the raw bytes
+    # go to the snapshot store as they are read
+    for stage in ("store", "parse", "ingest"):
+        progress.start(stage)
+    with SnapshotWriter() as writer:
+        try:
+            summary = ingest_events(stream_json(TeeReader(body, writer)),
+                                    user, mode=mode)
+        except ijson.JSONError as e:
+            progress.fail("parse", str(e))
+            return ({"data": f"Error formatting JSON {str(e)}"},
+                    status.HTTP_401_UNAUTHORIZED)
+        except DECOMPRESSION_ERRORS as e:
+            progress.fail("parse", str(e))
+            return ({"data": f"Error decompressing report {str(e)}"},
+                    status.HTTP_401_UNAUTHORIZED)
+        except DOWNLOAD_ERRORS as e:
+            return download_failed(progress, e)
+        snapshot = store_snapshot(account, writer, progress)
+    progress.done("parse")
+    progress.done("ingest", **summary)
+
+    return ({"message": "Data saved successfully.", **summary,
+             "snapshot": snapshot and snapshot.digest}, status.HTTP_200_OK)
+
+
+def download_failed(progress, error):
+    # The connection to S3 broke off mid-report; nothing was ingested
+    progress.fail("fetch", str(error))
+    return ({"data": f"Error downloading report {str(error)}"},
+            status.HTTP_502_BAD_GATEWAY)
+
+
+def store_snapshot(account, writer, progress):
+    # The ingest has committed by now, so the refresh succeeds (and its
+    # ETag is saved) even when the raw report cannot be kept
+    try:
+        snapshot = record_snapshot(account, writer)
+    except Exception as e:
+        logger.exception("Could not store the report snapshot of account %s", account.pk)
+        progress.fail("store", str(e))
+        return None
+    progress.done("store", size=snapshot.size, digest=snapshot.digest)
+    return snapshot
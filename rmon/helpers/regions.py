@@ -0,0 +1,54 @@
+import logging
+
+from rest_framework.renderers import JSONRenderer
+
+from ..models import Region, RegionDocument
+from ..serializers import RESOURCE_SERIALIZERS, values_serializer
+from .generations import live_generation
+from .ingest import RESOURCE_TYPES, region_resources
+
+logger = logging.getLogger(__name__)
+
+# Fast rendering of RegionDetailView. Resources are read through
+# ValuesSerializer, one query per resource type; the output is the same as
+# RegionSerializer's. With RMON_REGION_DOCUMENTS the rendered JSON is
+# also stored per region after each ingest and served as-is.
+
+
+def resource_rows(region, rtype):
+    rows = region_resources(region.pk, rtype).order_by('pk')
+    return values_serializer(RESOURCE_SERIALIZERS[rtype.name]).rows(rows)
+
+
+def region_data(region):
+    data = {'id': region.pk}
+    for rtype in RESOURCE_TYPES.values():
+        data[rtype.relation] = resource_rows(region, rtype)
+    data['name'] = region.name
+    return data
+
+
+def render_region(region):
+    return JSONRenderer().render(region_data(region)).decode()
+
+
+def region_document(scope, name):
+    if scope.account_id is None:
+        return None
+    return RegionDocument.objects.filter(region__account_id=scope.account_id,
+                                         region__generation=scope.generation,
+                                         region__name=name) \
+        .values_list('content', flat=True).first()
+
+
+def render_region_documents(account_id):
+    # Runs after an ingest of the account committed; until it is done the
+    # view falls back to rendering from the tables
+    try:
+        regions = Region.objects.filter(account_id=account_id,
+                                        generation=live_generation(account_id))
+        for region in regions.order_by('pk'):
+            RegionDocument.objects.update_or_create(
+                region=region, defaults={'content': render_region(region)})
+    except Exception:
+        logger.exception("Could not render region documents")
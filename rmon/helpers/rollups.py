@@ -0,0 +1,238 @@
+from datetime import timedelta, timezone as dt_timezone
+from decimal import Decimal
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import TruncDay, TruncHour, TruncMonth
+from django.utils import timezone
+
+from ..models import CumulativeCostHistory, CumulativeCostRollup
+from .cache import bump_generation
+from .queries import COST_BUCKETS, COST_FIELDS
+
+# CumulativeCostHistory gets one row per refresh of an account. Compaction
+# runs per account and rolls complete hours of raw rows into hourly
+# rollups, complete days of hourly rollups into daily ones and complete
+# months of daily rollups into monthly ones.
+# Retention then deletes raw rows and hourly/daily rollups past their age,
+# but only those already covered by the next coarser level, and whole
+# periods of that level at a time.
+#
+# Each level's watermark is the end of its latest period: data before it
+# is in that level, data after it only in finer levels. A range query reads
+# the coarsest level that is still at least as fine as the requested
+# bucket, and finer levels and raw rows after its watermark.
+#
+# Un-bucketed ranges return the raw samples where retention kept them and,
+# before those, one averaged point per period of the finest rollup level
+# left (cost_points), so old ranges thin out instead of going empty.
+# Compaction changes those results and bumps the account's cache generation.
+
+HOUR, DAY, MONTH = CumulativeCostRollup.HOUR, CumulativeCostRollup.DAY, \
+    CumulativeCostRollup.MONTH
+LEVELS = (HOUR, DAY, MONTH)
+TRUNCS = {HOUR: TruncHour, DAY: TruncDay, MONTH: TruncMonth}
+
+# Rollup level read for each range bucket
+BUCKET_LEVELS = {'hour': HOUR, 'day': DAY, 'week': DAY, 'month': MONTH}
+
+ROLLUP_FIELDS = ['samples'] + [f"{field}_{stat}" for field in COST_FIELDS
+                               for stat in ('sum', 'min', 'max')]
+
+
+def period_start(level, moment):
+    moment = moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    if level in (DAY, MONTH):
+        moment = moment.replace(hour=0)
+    if level == MONTH:
+        moment = moment.replace(day=1)
+    return moment
+
+
+def next_period(level, start):
+    if level == HOUR:
+        return start + timedelta(hours=1)
+    if level == DAY:
+        return start + timedelta(days=1)
+    return (start + timedelta(days=32)).replace(day=1)
+
+
+def watermark(account_id, level):
+    latest = CumulativeCostRollup.objects.filter(account_id=account_id, resolution=level) \
+        .aggregate(latest=Max('period_start'))['latest']
+    return next_period(level, latest) if latest else None
+
+
+def raw_aggregates():
+    aggregates = {'samples': Count('id')}
+    for field in COST_FIELDS:
+        aggregates[f"{field}_sum"] = Sum(field)
+        aggregates[f"{field}_min"] = Min(field)
+        aggregates[f"{field}_max"] = Max(field)
+    return aggregates
+
+
+def rollup_aggregates():
+    aggregates = {'samples': Sum('samples')}
+    for field in COST_FIELDS:
+        aggregates[f"{field}_sum"] = Sum(f"{field}_sum")
+        aggregates[f"{field}_min"] = Min(f"{field}_min")
+        aggregates[f"{field}_max"] = Max(f"{field}_max")
+    return aggregates
+
+
+def source(account_id, level, lower=None, upper=None):
+    # Rows of one account and level (None: raw history) in [lower, upper),
+    # as (queryset, time field, aggregates)
+    if level is None:
+        rows, time_field, aggregates = CumulativeCostHistory.objects.filter(
+            account_id=account_id), 'recorded_at', raw_aggregates()
+    else:
+        rows, time_field, aggregates = CumulativeCostRollup.objects.filter(
+            account_id=account_id, resolution=level), 'period_start', rollup_aggregates()
+    if lower is not None:
+        rows = rows.filter(**{f"{time_field}__gte": lower})
+    if upper is not None:
+        rows = rows.filter(**{f"{time_field}__lt": upper})
+    return rows, time_field, aggregates
+
+
+def grouped(rows, time_field, aggregates, trunc):
+    return rows.order_by() \
+        .annotate(period=trunc(time_field, tzinfo=dt_timezone.utc)) \
+        .values('period').annotate(**aggregates).order_by('period')
+
+
+@transaction.atomic
+def compact_cost_history(now=None):
+    now = now or timezone.now()
+    created = dict.fromkeys(LEVELS, 0)
+    deleted = dict.fromkeys(['raw', HOUR, DAY], 0)
+
+    accounts = CumulativeCostHistory.objects.exclude(account=None) \
+        .values_list('account_id', flat=True).distinct()
+    for account_id in accounts.order_by('account_id'):
+        compact_account(account_id, now, created, deleted)
+
+    return {"created": created, "deleted": deleted}
+
+
+def compact_account(account_id, now, created, deleted):
+    changes = sum(created.values()) + sum(deleted.values())
+    finer = None
+    for level in LEVELS:
+        # Complete periods after this level's watermark, from the level below
+        rows, time_field, aggregates = source(account_id, finer,
+                                              lower=watermark(account_id, level),
+                                              upper=period_start(level, now))
+        rollups = [
+            CumulativeCostRollup(account_id=account_id, resolution=level,
+                                 period_start=group.pop('period'), **group)
+            for group in grouped(rows, time_field, aggregates, TRUNCS[level])
+        ]
+        if rollups:
+            CumulativeCostRollup.objects.bulk_create(
+                rollups,
+                update_conflicts=True,
+                unique_fields=['account', 'resolution', 'period_start'],
+                update_fields=ROLLUP_FIELDS,
+            )
+        created[level] += len(rollups)
+        finer = level
+
+    retention = {
+        None: settings.RMON_COST_RAW_RETENTION_DAYS,
+        HOUR: settings.RMON_COST_HOURLY_RETENTION_DAYS,
+        DAY: settings.RMON_COST_DAILY_RETENTION_DAYS,
+    }
+    for level, coarser in ((None, HOUR), (HOUR, DAY), (DAY, MONTH)):
+        covered = watermark(account_id, coarser)
+        if covered is None:
+            continue
+        cutoff = min(period_start(coarser, now - timedelta(days=retention[level])), covered)
+        rows, _, _ = source(account_id, level, upper=cutoff)
+        deleted[level or 'raw'] += rows.delete()[0]
+
+    if sum(created.values()) + sum(deleted.values()) != changes:
+        transaction.on_commit(partial(bump_generation, account_id))
+
+
+def cost_points(account_id, start, end):
+    # (time, *COST_FIELDS) samples of one account in [start, end], oldest
+    # first. Each level is read before the periods the finer ones cover
+    # completely; the earliest row of a level lies in such a period, as
+    # retention deletes whole periods of the next coarser level.
+    if account_id is None:
+        return []
+    sources, upper = [], None
+    for level, coarser in ((None, HOUR), (HOUR, DAY), (DAY, MONTH), (MONTH, None)):
+        rows, time_field, _ = source(account_id, level, upper=upper)
+        until = 'lte' if level is None else 'lt'
+        sources.append((level, rows.filter(**{f"{time_field}__gte": start,
+                                              f"{time_field}__{until}": end})))
+        if coarser is None:
+            break
+        first = source(account_id, level)[0].aggregate(first=Min(time_field))['first']
+        moments = [moment for moment in (first, upper) if moment is not None]
+        if moments:
+            upper = period_start(coarser, min(moments))
+
+    points = []
+    for level, rows in reversed(sources):
+        if level is None:
+            points.extend(rows.order_by('recorded_at').values_list('recorded_at', *COST_FIELDS))
+            continue
+        for rollup in rows.order_by('period_start').values('period_start', *ROLLUP_FIELDS):
+            points.append((rollup['period_start'], *(
+                (rollup[f"{field}_sum"] / rollup['samples']).quantize(Decimal('0.01'))
+                for field in COST_FIELDS)))
+    return points
+
+
+def bucketed_costs(account_id, start, end, bucket):
+    # Avg/min/max of every cost column per bucket and the sample count,
+    # grouped in the database, for one account. The range start is aligned to the rollup
+    # period, so the first bucket is not cut short.
+    if account_id is None:
+        return []
+    trunc = COST_BUCKETS[bucket][0]
+    coarsest = LEVELS.index(BUCKET_LEVELS[bucket])
+
+    sources, lower = [], None
+    for level in reversed(LEVELS[:coarsest + 1]):
+        upper = watermark(account_id, level)
+        if upper is None:
+            continue
+        sources.append(source(account_id, level, lower=lower, upper=upper))
+        lower = upper
+    sources.append(source(account_id, None, lower=lower))
+
+    points = {}
+    start = period_start(BUCKET_LEVELS[bucket], start)
+    for rows, time_field, aggregates in sources:
+        # A rollup period starting at the end of the range lies after it
+        until = 'lte' if time_field == 'recorded_at' else 'lt'
+        rows = rows.filter(**{f"{time_field}__gte": start, f"{time_field}__{until}": end})
+        for group in grouped(rows, time_field, aggregates, trunc):
+            point = points.get(group['period'])
+            if point is None:
+                points[group['period']] = group
+                continue
+            point['samples'] += group['samples']
+            for field in COST_FIELDS:
+                point[f"{field}_sum"] += group[f"{field}_sum"]
+                point[f"{field}_min"] = min(point[f"{field}_min"], group[f"{field}_min"])
+                point[f"{field}_max"] = max(point[f"{field}_max"], group[f"{field}_max"])
+
+    result = []
+    for period in sorted(points):
+        group = points[period]
+        point = {'bucket': period, 'samples': group['samples']}
+        for field in COST_FIELDS:
+            point[f"{field}_avg"] = group[f"{field}_sum"] / group['samples']
+            point[f"{field}_min"] = group[f"{field}_min"]
+            point[f"{field}_max"] = group[f"{field}_max"]
+        result.append(point)
+    return result
@@ -0,0 +1,76 @@
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from credman.models import AWSAccountCredentials as aac
+
+from ..models import IngestJob, RefreshSchedule
+
+
+def expire_stale_jobs(now):
+    # Jobs whose worker died never report back; stop them holding a slot
+    cutoff = now - timedelta(seconds=settings.RMON_REFRESH_JOB_TIMEOUT)
+    return IngestJob.objects.filter(
+        status__in=IngestJob.ACTIVE_STATUSES, created_at__lt=cutoff
+    ).update(status=IngestJob.FAILURE,
+             result={"error": "Refresh timed out."},
+             finished_at=now)
+
+
+def claim_due_accounts(now):
+    # Pick the accounts to refresh now, within the global concurrency cap,
+    # and push their next run out so the next tick doesn't pick them again
+    active = IngestJob.objects.filter(status__in=IngestJob.ACTIVE_STATUSES)
+    slots = settings.RMON_REFRESH_MAX_CONCURRENCY - active.count()
+    if slots <= 0:
+        return []
+
+    due = aac.objects.exclude(
+        user_id__in=active.values('user_id')
+    ).filter(
+        Q(refresh_schedule__isnull=True) |
+        Q(refresh_schedule__next_run_at__isnull=True) |
+        Q(refresh_schedule__next_run_at__lte=now)
+    ).order_by(
+        F('refresh_schedule__next_run_at').asc(nulls_first=True), 'pk'
+    )[:slots]
+
+    claimed = []
+    for credentials in due:
+        RefreshSchedule.objects.update_or_create(
+            credentials=credentials,
+            defaults={
+                'last_run_at': now,
+                'next_run_at': now + timedelta(seconds=settings.RMON_REFRESH_JOB_TIMEOUT),
+            })
+        claimed.append(credentials)
+    return claimed
+
+
+def jitter():
+    return random.uniform(0, settings.RMON_REFRESH_JITTER)
+
+
+def record_refresh(user, succeeded, now=None):
+    # Schedule the account's next run: the regular interval after a
+    # success, exponential back-off after consecutive failures
+    now = now or timezone.now()
+    credentials = aac.objects.filter(user=user).first()
+    if credentials is None:
+        return None
+
+    schedule, _ = RefreshSchedule.objects.get_or_create(credentials=credentials)
+    interval = settings.RMON_REFRESH_INTERVAL
+    if succeeded:
+        schedule.consecutive_failures = 0
+        schedule.last_success_at = now
+    else:
+        schedule.consecutive_failures += 1
+        interval = min(interval * 2 ** schedule.consecutive_failures,
+                       settings.RMON_REFRESH_BACKOFF_MAX)
+    schedule.next_run_at = now + timedelta(seconds=interval + jitter())
+    schedule.save()
+    return schedule
@@ -0,0 +1,146 @@
+import fcntl
+import gzip
+import hashlib
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import ReportSnapshot
+
+# Raw report bytes are stored once per distinct content, gzip-compressed,
+# under <root>/<first two hex digits>/<sha256>.json.gz. Files are written
+# to a temporary name and renamed into place, so a reader never sees a
+# partial snapshot. ReportSnapshot rows index which snapshots belong to
+# which account; files no row points to are removed by prune_snapshots.
+#
+# Accounts with the same report share its file. Placing a file and
+# recording its row happen under the store lock, as does pruning, so a
+# file is never removed between another account's check for it and its row.
+
+SUFFIX = '.json.gz'
+
+
+def snapshot_root():
+    return settings.RMON_SNAPSHOT_ROOT
+
+
+def snapshot_path(digest):
+    return os.path.join(snapshot_root(), digest[:2], digest + SUFFIX)
+
+
+@contextmanager
+def store_lock():
+    # Exclusive across the processes sharing the store
+    os.makedirs(snapshot_root(), exist_ok=True)
+    with open(os.path.join(snapshot_root(), 'lock'), 'a') as lock:
+        fcntl.lockf(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.lockf(lock, fcntl.LOCK_UN)
+
+
+class SnapshotWriter:
+    # File-like sink: hashes and compresses whatever is written to it
+
+    def __init__(self):
+        tmp_dir = os.path.join(snapshot_root(), 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        self.tmp = tempfile.NamedTemporaryFile(dir=tmp_dir, suffix=SUFFIX, delete=False)
+        self.gzip = gzip.GzipFile(fileobj=self.tmp, mode='wb',
+                                  compresslevel=settings.RMON_SNAPSHOT_COMPRESSLEVEL,
+                                  mtime=0)
+        self.hash = hashlib.sha256()
+        self.size = 0
+        self.digest = None
+
+    def write(self, data):
+        self.hash.update(data)
+        self.gzip.write(data)
+        self.size += len(data)
+        return len(data)
+
+    def commit(self):
+        # Returns the content digest; an existing snapshot with the same
+        # content is kept and the new copy dropped
+        self.gzip.close()
+        self.tmp.flush()
+        os.fsync(self.tmp.fileno())
+        self.tmp.close()
+        self.digest = self.hash.hexdigest()
+
+        path = snapshot_path(self.digest)
+        if os.path.exists(path):
+            os.unlink(self.tmp.name)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self.tmp.name, path)
+        return self.digest
+
+    def discard(self):
+        if self.digest is not None:
+            return
+        self.gzip.close()
+        self.tmp.close()
+        if os.path.exists(self.tmp.name):
+            os.unlink(self.tmp.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.discard()
+
+
+def record_snapshot(account, writer):
+    # The row is committed before the lock is released
+    with store_lock(), transaction.atomic():
+        digest = writer.commit()
+        snapshot = ReportSnapshot.objects.create(
+            account=account,
+            digest=digest,
+            size=writer.size,
+            stored_size=os.path.getsize(snapshot_path(digest)),
+        )
+    prune_snapshots(account)
+    return snapshot
+
+
+def prune_snapshots(account=None):
+    # Keep the newest RMON_SNAPSHOT_KEEP snapshots per account, dropping
+    # those older than RMON_SNAPSHOT_MAX_AGE_DAYS, then delete the files no
+    # snapshot points to any more
+    snapshots = ReportSnapshot.objects.all()
+    if account is not None:
+        snapshots = snapshots.filter(account=account)
+
+    expired = set()
+    cutoff = timezone.now() - timedelta(days=settings.RMON_SNAPSHOT_MAX_AGE_DAYS)
+    for account_id in snapshots.values_list('account_id', flat=True).distinct():
+        ids = list(ReportSnapshot.objects.filter(account_id=account_id)
+                   .order_by('-created_at').values_list('id', 'created_at'))
+        for position, (snapshot_id, created_at) in enumerate(ids):
+            # The latest snapshot is always kept
+            if position >= settings.RMON_SNAPSHOT_KEEP or \
+                    (position > 0 and created_at < cutoff):
+                expired.add(snapshot_id)
+    if not expired:
+        return 0
+
+    digests = set(ReportSnapshot.objects.filter(id__in=expired)
+                  .values_list('digest', flat=True))
+    with store_lock():
+        ReportSnapshot.objects.filter(id__in=expired).delete()
+        still_used = set(ReportSnapshot.objects.filter(digest__in=digests)
+                         .values_list('digest', flat=True))
+        for digest in digests - still_used:
+            try:
+                os.unlink(snapshot_path(digest))
+            except FileNotFoundError:
+                pass
+    return len(expired)
@@ -0,0 +1,111 @@
+import random
+
+# Synthetic reports in the layout of the S3 report, used by the benchmark
+# management commands
+
+REGION_NAMES = [
+    'us-east-1', 'us-east-2', 'us-west-1', 'us-west-2', 'ca-central-1',
+    'eu-west-1', 'eu-west-2', 'eu-west-3', 'eu-central-1', 'eu-north-1',
+    'ap-south-1', 'ap-northeast-1', 'ap-northeast-2', 'ap-northeast-3',
+    'ap-southeast-1', 'ap-southeast-2', 'sa-east-1',
+]
+
+
+def usd(value):
+    return f"{value:.2f} USD"
+
+
+def synthetic_tags(rng):
+    return [{"Key": "env", "Value": rng.choice(["dev", "staging", "prod"])},
+            {"Key": "team", "Value": rng.choice(["web", "data", "ops"])}]
+
+
+def synthetic_region(rng, index, region, resources):
+    def ident(prefix, i):
+        return f"{prefix}-{index:02d}{i:08x}"
+
+    return {
+        "StoppedEC2Instances": [{
+            "InstanceId": ident("i", i),
+            "InstanceType": rng.choice(["t3.micro", "m5.large", "c5.xlarge"]),
+            "LaunchTime": "2023-05-01T10:00:00+00:00",
+            "Region": region,
+            "Age": rng.randint(1, 900),
+            "Tags": synthetic_tags(rng),
+            "Status": "stopped",
+            "PotentialCostSavings": usd(rng.uniform(1, 500)),
+            "Recommendations": "Terminate or downsize the stopped instance.",
+        } for i in range(resources)],
+        "UnusedRDSInstances": [{
+            "DBInstanceIdentifier": ident("db", i),
+            "DBInstanceClass": rng.choice(["db.t3.micro", "db.m5.large"]),
+            "BackupType": "automated",
+            "Region": region,
+            "PotentialCostSavings": usd(rng.uniform(10, 900)),
+            "Recommendations": "Delete the unused database instance.",
+        } for i in range(resources)],
+        "AvailableEBSVolumes": [{
+            "VolumeId": ident("vol", i),
+            "Size": rng.choice([8, 20, 100, 500]),
+            "Region": region,
+            "Tags": synthetic_tags(rng),
+            "PotentialCostSavings": usd(rng.uniform(1, 60)),
+            "Recommendations": "Delete the unattached volume.",
+        } for i in range(resources)],
+        "OldRDSSnapshots": [{
+            "SnapshotId": ident("rds-snap", i),
+            "CreationDate": "2022-01-15T08:30:00+00:00",
+            "Region": region,
+            "PotentialCostSavings": usd(rng.uniform(1, 30)),
+            "Recommendations": "Delete the old snapshot.",
+        } for i in range(resources)],
+        "OldEBSSnapshots": [{
+            "SnapshotId": ident("snap", i),
+            "StartTime": "2021-11-02T12:00:00+00:00",
+            "Region": region,
+            "PotentialCostSavings": usd(rng.uniform(1, 30)),
+            "Recommendations": "Delete the old snapshot.",
+        } for i in range(resources)],
+        "AvailableElasticIPs": [{
+            "AllocationId": ident("eipalloc", i),
+            "PublicIp": f"10.{index}.{i // 250 % 250}.{i % 250 + 1}",
+            "Region": region,
+            "Tags": synthetic_tags(rng),
+            "PotentialCostSavings": usd(3.6),
+            "Recommendations": "Release the unassociated address.",
+        } for i in range(resources)],
+    }
+
+
+def synthetic_report(regions=len(REGION_NAMES), resources=100, seed=0):
+    # resources is the number of records per resource type and region
+    rng = random.Random(seed)
+    report = {
+        "account_id": "123456789012",
+        "project_name": "synthetic",
+        "global": {
+            "IAMUsers": [{
+                "UserId": f"AIDA{i:016d}",
+                "UserName": f"user-{i}",
+                "Tags": [],
+                "LastLogin": "2024-01-01T00:00:00+00:00",
+            } for i in range(resources)],
+            "S3Buckets": [{
+                "BucketName": f"synthetic-bucket-{i}",
+                "CreationDate": "2020-06-01T00:00:00+00:00",
+                "Tags": [],
+                "Status": "Unused",
+            } for i in range(resources)],
+            "CumulativeCostOptimization": {
+                "EC2": "1000.00 USD", "RDS": "500.00 USD", "EBS": "250.00 USD",
+                "RDSSnapshots": "40.00 USD", "EBSSnapshots": "60.00 USD",
+                "ElasticIPs": "36.00 USD",
+            },
+        },
+    }
+    for index in range(regions):
+        region = REGION_NAMES[index % len(REGION_NAMES)]
+        if index >= len(REGION_NAMES):
+            region = f"{region}-{index // len(REGION_NAMES)}"
+        report[region] = synthetic_region(rng, index, region, resources)
+    return report
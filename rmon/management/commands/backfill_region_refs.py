@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max, OuterRef, Subquery
+
+from rmon.helpers.ingest import RESOURCE_TYPES, link_columns, region_fk
+
+
+class Command(BaseCommand):
+    help = "Fill region_ref of the regional resources from the Region " \
+           "many-to-many links. Run it before switching RMON_REGION_SCHEMA " \
+           "to fk; ingests keep region_ref current from then on."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help="Rows updated per transaction.")
+        parser.add_argument('--clear-links', action='store_true',
+                            help="Delete the many-to-many links afterwards "
+                                 "(only with RMON_REGION_SCHEMA=fk).")
+
+    def handle(self, *args, **options):
+        if options['clear_links'] and not region_fk():
+            raise CommandError("--clear-links needs RMON_REGION_SCHEMA=fk, "
+                               "the m2m schema still reads the links.")
+        batch_size = options['batch_size']
+
+        for rtype in RESOURCE_TYPES.values():
+            through, source, target = link_columns(rtype.relation)
+            region = through.objects.filter(**{target: OuterRef('pk')}) \
+                .order_by(source).values(source)[:1]
+            last = rtype.model.objects.aggregate(last=Max('pk'))['last'] or 0
+
+            # pk ranges keep each transaction and its row locks short. Rows
+            # that have a region_ref already (written by fk ingests, which
+            # add no links) keep it.
+            updated = 0
+            for start in range(0, last, batch_size):
+                with transaction.atomic():
+                    updated += rtype.model.objects.filter(
+                        pk__gt=start, pk__lte=start + batch_size, region_ref__isnull=True,
+                    ).update(region_ref=Subquery(region))
+            self.stdout.write(f"{rtype.name}: {updated} rows")
+
+            if options['clear_links']:
+                deleted = through.objects.all().delete()[0]
+                self.stdout.write(f"{rtype.name}: {deleted} links deleted")
@@ -0,0 +1,80 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from credman.models import AWSAccountCredentials
+
+from rmon.helpers.ingest import GLOBAL_TYPES, RESOURCE_TYPES, ingest_report
+from rmon.helpers.synthetic import synthetic_report
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compare the ORM and COPY ingest loaders on a synthetic report: " \
+           "a first load into empty tables and a reload of the same report. " \
+           "Everything is written in a transaction that is rolled back."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--regions', type=int, default=17)
+        parser.add_argument('--resources', type=int, default=2000,
+                            help="Records per resource type and region.")
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("The COPY loader needs PostgreSQL.")
+        report = synthetic_report(options['regions'], options['resources'])
+        rows = sum(len(records) for section, payload in report.items()
+                   if isinstance(payload, dict)
+                   for records in payload.values() if isinstance(records, list))
+
+        self.stdout.write(f"{rows} records, batch size "
+                          f"{options['batch_size'] or 'RMON_INGEST_BATCH_SIZE'}")
+        self.stdout.write(f"{'loader':<8}{'load s':>9}{'reload s':>10}")
+        reference = None
+        for loader in ('orm', 'copy'):
+            loads, reloads = [], []
+            for _ in range(options['repeat']):
+                load, reload, content = self.run(loader, report, options['batch_size'])
+                loads.append(load)
+                reloads.append(reload)
+            if reference is None:
+                reference = content
+            elif content != reference:
+                raise CommandError(f"The {loader} loader wrote different rows")
+            self.stdout.write(f"{loader:<8}{min(loads):>9.3f}{min(reloads):>10.3f}")
+        self.stdout.write("Both loaders wrote identical rows.")
+
+    def run(self, loader, report, batch_size):
+        try:
+            with transaction.atomic(), override_settings(RMON_INGEST_LOADER=loader,
+                                                         RMON_SYNC_MODE='replace'):
+                user = User.objects.create(username=f"benchmark-{time.time_ns()}")
+                account = AWSAccountCredentials.objects.create(user=user)
+                start = time.perf_counter()
+                ingest_report(report, user, batch_size=batch_size, workers=1)
+                load = time.perf_counter() - start
+                start = time.perf_counter()
+                ingest_report(report, user, batch_size=batch_size, workers=1)
+                reload = time.perf_counter() - start
+                content = self.content(account)
+                raise Rollback()
+        except Rollback:
+            pass
+        return load, reload, content
+
+    def content(self, account):
+        # Stored rows without keys that differ between runs
+        content = {}
+        for rtype in list(GLOBAL_TYPES.values()) + list(RESOURCE_TYPES.values()):
+            fields = [field.attname for field in rtype.model._meta.concrete_fields
+                      if field.attname not in ('id', 'account_id', 'region_ref_id')]
+            content[rtype.name] = sorted(
+                map(repr, rtype.model.objects.filter(account=account).values_list(*fields)))
+        return content
@@ -0,0 +1,68 @@
+import gzip
+import io
+import json
+import time
+import tracemalloc
+
+import zstandard
+from django.core.management.base import BaseCommand
+
+from rmon.helpers.fetch_json import GZIP, ZSTD, decompressing_reader, stream_json
+from rmon.helpers.synthetic import synthetic_report
+
+
+class Command(BaseCommand):
+    help = "Compare plain, gzip and zstd report objects: size, compression " \
+           "time, and time and peak memory to stream-parse them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--regions', type=int, default=17)
+        parser.add_argument('--resources', type=int, default=500,
+                            help="Records per resource type and region.")
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--gzip-level', type=int, default=6)
+        parser.add_argument('--zstd-level', type=int, default=3)
+
+    def handle(self, *args, **options):
+        raw = json.dumps(synthetic_report(options['regions'],
+                                          options['resources'])).encode()
+        encoders = [
+            ('plain', None, lambda data: data),
+            ('gzip', GZIP,
+             lambda data: gzip.compress(data, compresslevel=options['gzip_level'])),
+            ('zstd', ZSTD,
+             lambda data: zstandard.ZstdCompressor(level=options['zstd_level']).compress(data)),
+        ]
+
+        self.stdout.write(f"report: {len(raw) / 1e6:.1f} MB uncompressed")
+        self.stdout.write(f"{'format':<8}{'size MB':>10}{'ratio':>8}"
+                          f"{'encode s':>10}{'parse s':>10}{'peak MB':>10}")
+        for name, compression, encode in encoders:
+            start = time.perf_counter()
+            payload = encode(raw)
+            encode_time = time.perf_counter() - start
+
+            parse_times = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                self.parse(payload, compression)
+                parse_times.append(time.perf_counter() - start)
+
+            tracemalloc.start()
+            self.parse(payload, compression)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            self.stdout.write(
+                f"{name:<8}{len(payload) / 1e6:>10.2f}"
+                f"{len(raw) / len(payload):>8.1f}{encode_time:>10.3f}"
+                f"{min(parse_times):>10.3f}{peak / 1e6:>10.2f}")
+
+    def parse(self, payload, compression):
+        # The payload itself is excluded from the peak: only what the
+        # decompressor and parser hold counts
+        events = 0
+        reader = decompressing_reader(io.BytesIO(payload), compression)
+        for _ in stream_json(reader):
+            events += 1
+        return events
@@ -0,0 +1,85 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from credman.models import AWSAccountCredentials
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from rmon.helpers.ingest import ingest_report
+from rmon.helpers.synthetic import synthetic_report
+from rmon.renderers import FastJSONRenderer
+from rmon.serializers import RESOURCE_SERIALIZERS, values_serializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compare ModelSerializer + JSONRenderer with ValuesSerializer + " \
+           "FastJSONRenderer on a synthetic dataset. The dataset is written " \
+           "in a transaction that is rolled back at the end."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--regions', type=int, default=17)
+        parser.add_argument('--resources', type=int, default=200,
+                            help="Records per resource type and region.")
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                user = User.objects.create(username=f"benchmark-{time.time_ns()}")
+                self.account = AWSAccountCredentials.objects.create(user=user)
+                ingest_report(synthetic_report(options['regions'],
+                                               options['resources']), user)
+                self.run(options['repeat'])
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def run(self, repeat):
+        paths = [
+            ('serializer', self.serialize, JSONRenderer()),
+            ('values', self.serialize_values, JSONRenderer()),
+            ('values+orjson', self.serialize_values, FastJSONRenderer()),
+        ]
+        self.stdout.write(f"{'path':<15}{'rows':>8}{'serialize s':>13}"
+                          f"{'render s':>10}{'total s':>9}{'MB':>7}")
+        reference = None
+        for name, serialize, renderer in paths:
+            serialize_times, render_times = [], []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                data = serialize()
+                serialize_times.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                content = renderer.render(data)
+                render_times.append(time.perf_counter() - start)
+
+            if reference is None:
+                reference = content
+            elif content != reference:
+                raise CommandError(f"{name} output differs from the serializer output")
+            rows = sum(len(rows) for rows in data.values())
+            self.stdout.write(
+                f"{name:<15}{rows:>8}{min(serialize_times):>13.3f}"
+                f"{min(render_times):>10.3f}"
+                f"{min(serialize_times) + min(render_times):>9.3f}"
+                f"{len(content) / 1e6:>7.2f}")
+        self.stdout.write("All paths produced identical JSON.")
+
+    def serialize(self):
+        return {
+            name: serializer_class(serializer_class.Meta.model.objects.filter(
+                account=self.account), many=True).data
+            for name, serializer_class in RESOURCE_SERIALIZERS.items()
+        }
+
+    def serialize_values(self):
+        return {
+            name: values_serializer(serializer_class).rows(
+                serializer_class.Meta.model.objects.filter(account=self.account))
+            for name, serializer_class in RESOURCE_SERIALIZERS.items()
+        }
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from rmon.helpers.rollups import compact_cost_history
+
+
+class Command(BaseCommand):
+    help = "Roll CumulativeCostHistory into hourly, daily and monthly rollups " \
+           "and delete rows past the RMON_COST_*_RETENTION_DAYS settings."
+
+    def handle(self, *args, **options):
+        summary = compact_cost_history()
+        for level, count in summary["created"].items():
+            self.stdout.write(f"{level} rollups written: {count}")
+        for level, count in summary["deleted"].items():
+            self.stdout.write(f"{level} rows deleted: {count}")
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from rmon.models import IAMUser, S3Bucket, EC2Instance, EBSVolume, \
+    RDSSnapshot, ElasticIP, RDSInstance, EC2Snapshot, Region, \
+    SavingsRanking, SavingsSummary, CumulativeCost, CumulativeCostHistory, \
+    CumulativeCostRollup
+
+# Rows ingested before resources were scoped by account have no account and
+# are no longer served. The next refresh of each account ingests its own:
+# run_refresh ignores the stored report ETag while an account has no rows.
+UNSCOPED_MODELS = (IAMUser, S3Bucket, EC2Instance, EBSVolume, RDSSnapshot,
+                   ElasticIP, RDSInstance, EC2Snapshot, Region, SavingsRanking,
+                   SavingsSummary, CumulativeCost, CumulativeCostHistory,
+                   CumulativeCostRollup)
+
+
+class Command(BaseCommand):
+    help = "Delete rmon rows that belong to no AWS account (ingested before " \
+           "rows were scoped by account)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only count the rows.")
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        for model in UNSCOPED_MODELS:
+            rows = model.objects.filter(account=None)
+            if options['dry_run']:
+                count = rows.count()
+            else:
+                count = rows.delete()[0]
+            self.stdout.write(f"{model.__name__}: {count}")
@@ -1,8 +1,52 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex
+
+
+def account_field():
+    # Tenant of a row. Nullable so existing rows survive the schema change;
+    # not indexed on its own, every composite index below starts with it
+    return models.ForeignKey('credman.AWSAccountCredentials', on_delete=models.CASCADE,
+                             null=True, blank=True, db_index=False)
+
+
+def generation_field():
+    # Ingest run that wrote the row (helpers.generations); 0 unless
+    # RMON_SNAPSHOT_GENERATIONS is set
+    return models.PositiveIntegerField(default=0)
+
+
+def account_key(prefix, *fields):
+    # Natural keys are unique per account and generation
+    return models.UniqueConstraint(fields=['account', 'generation', *fields],
+                                   name=f'{prefix}_account_key')
+
+
+def region_field():
+    # Region of a regional resource when RMON_REGION_SCHEMA is fk (the
+    # Region many-to-many links when it is m2m); see helpers.ingest
+    return models.ForeignKey('Region', on_delete=models.SET_NULL, null=True,
+                             blank=True, related_name='+', db_index=False)
+
+
+def resource_indexes(prefix):
+    # Indexes behind the resource list filters (rmon.filters); the GIN
+    # index answers tag containment queries on the tags jsonb. The
+    # region_ref index serves region reads in pk order.
+    return [
+        models.Index(fields=['region_ref', 'id'], name=f'{prefix}_region_ref_idx'),
+        models.Index(fields=['account', 'generation', 'region'], name=f'{prefix}_region_idx'),
+        models.Index(fields=['account', 'generation', 'potential_cost_savings'],
+                     name=f'{prefix}_savings_idx'),
+        GinIndex(fields=['tags'], name=f'{prefix}_tags_gin', opclasses=['jsonb_path_ops']),
+    ]
 
 class IAMUser(models.Model):
-    user_id = models.CharField(max_length=255, unique=True)
+    account = account_field()
+    generation = generation_field()
+    user_id = models.CharField(max_length=255)
     user_name = models.CharField(max_length=255)
     tags = models.JSONField(default=list, blank=True)
     last_login = models.TextField()
@@ -10,9 +54,12 @@ class IAMUser(models.Model):
     class Meta:
         verbose_name = 'IAM User'
         verbose_name_plural = 'IAM Users'
+        constraints = [account_key('rmon_iam', 'user_id')]
 
 class S3Bucket(models.Model):
-    bucket_name = models.CharField(max_length=255, unique=True)
+    account = account_field()
+    generation = generation_field()
+    bucket_name = models.CharField(max_length=255)
     creation_date = models.DateTimeField()
     tags = models.JSONField(default=list, blank=True)
     status = models.CharField(max_length=50)
@@ -20,9 +67,13 @@ class S3Bucket(models.Model):
     class Meta:
         verbose_name = 'S3 Bucket'
         verbose_name_plural = 'S3 Buckets'
+        constraints = [account_key('rmon_s3', 'bucket_name')]
 
 class EC2Instance(models.Model):
-    instance_id = models.CharField(max_length=255, unique=True)
+    account = account_field()
+    generation = generation_field()
+    region_ref = region_field()
+    instance_id = models.CharField(max_length=255)
     instance_type = models.CharField(max_length=50)
     launch_time = models.DateTimeField()
     region = models.CharField(max_length=50)
@@ -35,9 +86,14 @@ class EC2Instance(models.Model):
     class Meta:
         verbose_name = 'EC2 Instance'
         verbose_name_plural = 'EC2 Instances'
+        constraints = [account_key('rmon_ec2', 'instance_id')]
+        indexes = resource_indexes('rmon_ec2')
 
 class EBSVolume(models.Model):
-    volume_id = models.CharField(max_length=255, unique=True)
+    account = account_field()
+    generation = generation_field()
+    region_ref = region_field()
+    volume_id = models.CharField(max_length=255)
     size = models.IntegerField()
     region = models.CharField(max_length=50)
     status = models.CharField(max_length=50, null=True)
@@ -48,9 +104,14 @@ class EBSVolume(models.Model):
     class Meta:
         verbose_name = 'EBS Volume'
         verbose_name_plural = 'EBS Volumes'
+        constraints = [account_key('rmon_ebs', 'volume_id')]
+        indexes = resource_indexes('rmon_ebs')
 
 class RDSSnapshot(models.Model):
-    snapshot_id = models.CharField(max_length=255, unique=True)
+    account = account_field()
+    generation = generation_field()
+    region_ref = region_field()
+    snapshot_id = models.CharField(max_length=255)
     creation_date = models.DateTimeField()
     tags = models.JSONField(default=list, blank=True)
     region = models.CharField(max_length=50)
@@ -60,9 +121,14 @@ class RDSSnapshot(models.Model):
     class Meta:
         verbose_name = 'RDS Snapshot'
         verbose_name_plural = 'RDS Snapshots'
+        constraints = [account_key('rmon_rdssnap', 'snapshot_id')]
+        indexes = resource_indexes('rmon_rdssnap')
 
 class ElasticIP(models.Model):
-    allocation_id = models.CharField(max_length=255, unique=True)
+    account = account_field()
+    generation = generation_field()
+    region_ref = region_field()
+    allocation_id = models.CharField(max_length=255)
     public_ip = models.GenericIPAddressField()
     region = models.CharField(max_length=50)
     tags = models.JSONField(default=list, blank=True)
@@ -73,9 +139,14 @@ class ElasticIP(models.Model):
     class Meta:
         verbose_name = 'Elastic IP'
         verbose_name_plural = 'Elastic IPs'
+        constraints = [account_key('rmon_eip', 'allocation_id')]
+        indexes = resource_indexes('rmon_eip')
 
 class RDSInstance(models.Model):
-    db_instance_identifier = models.CharField(max_length=255, unique=True)
+    account = account_field()
+    generation = generation_field()
+    region_ref = region_field()
+    db_instance_identifier = models.CharField(max_length=255)
     db_instance_class = models.CharField(max_length=50)
     backup_type = models.CharField(max_length=50)
     tags = models.JSONField(default=list, blank=True)
@@ -86,9 +157,14 @@ class RDSInstance(models.Model):
     class Meta:
         verbose_name = 'RDS Instance'
         verbose_name_plural = 'RDS Instances'
+        constraints = [account_key('rmon_rds', 'db_instance_identifier')]
+        indexes = resource_indexes('rmon_rds')
 
 class EC2Snapshot(models.Model):
-    snapshot_id = models.CharField(max_length=255, unique=True)
+    account = account_field()
+    generation = generation_field()
+    region_ref = region_field()
+    snapshot_id = models.CharField(max_length=255)
     creation_date = models.DateTimeField()
     tags = models.JSONField(default=list, blank=True)
     region = models.CharField(max_length=50)
@@ -98,9 +174,13 @@ class EC2Snapshot(models.Model):
     class Meta:
         verbose_name = 'EC2 Snapshot'
         verbose_name_plural = 'EC2 Snapshots'
+        constraints = [account_key('rmon_ec2snap', 'snapshot_id')]
+        indexes = resource_indexes('rmon_ec2snap')
 
 class Region(models.Model):
-    name = models.CharField(max_length=50, unique=True)
+    account = account_field()
+    generation = generation_field()
+    name = models.CharField(max_length=50)
     stopped_ec2_instances = models.ManyToManyField(EC2Instance, related_name='regions_stopped')
     unused_rds_instances = models.ManyToManyField(RDSInstance, related_name='regions_unused_rds')
     available_ebs_volumes = models.ManyToManyField(EBSVolume, related_name='regions_available_ebs')
@@ -111,6 +191,76 @@ class Region(models.Model):
     class Meta:
         verbose_name = 'Region'
         verbose_name_plural = 'Regions'
+        constraints = [account_key('rmon_region', 'name')]
+
+
+class RegionDocument(models.Model):
+    # RegionDetailView response rendered after an ingest, see helpers.regions
+    region = models.OneToOneField(Region, on_delete=models.CASCADE,
+                                  primary_key=True, related_name='document')
+    content = models.TextField()
+    rendered_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Region Document'
+        verbose_name_plural = 'Region Documents'
+
+
+class SavingsRanking(models.Model):
+    # Resources with the largest potential_cost_savings across all regional
+    # resource types, rebuilt by every ingest; rank 1 saves the most
+    account = account_field()
+    generation = generation_field()
+    rank = models.PositiveIntegerField()
+    resource_type = models.CharField(max_length=50)
+    resource_id = models.CharField(max_length=255)
+    region = models.CharField(max_length=50)
+    potential_cost_savings = models.FloatField()
+    recommendations = models.TextField()
+
+    class Meta:
+        verbose_name = 'Savings Ranking'
+        verbose_name_plural = 'Savings Rankings'
+        constraints = [account_key('rmon_ranking', 'rank')]
+
+    def __str__(self):
+        return f"#{self.rank} {self.resource_type} {self.resource_id}"
+
+
+class SavingsSummary(models.Model):
+    # Per region and regional resource type: resource count, total and
+    # largest potential_cost_savings and the oldest creation date (types
+    # without one keep it empty); rebuilt by every ingest
+    account = account_field()
+    generation = generation_field()
+    region = models.CharField(max_length=50)
+    resource_type = models.CharField(max_length=50)
+    resource_count = models.PositiveIntegerField()
+    total_savings = models.FloatField()
+    max_savings = models.FloatField()
+    oldest_created = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Savings Summary'
+        verbose_name_plural = 'Savings Summaries'
+        constraints = [account_key('rmon_summary', 'region', 'resource_type')]
+
+    def __str__(self):
+        return f"{self.region} {self.resource_type}: {self.total_savings}"
+
+
+class LiveGeneration(models.Model):
+    # Generation of an account's rows that readers see, switched by the
+    # ingest that wrote the next one; allocated is the last one handed out
+    account = models.OneToOneField('credman.AWSAccountCredentials', on_delete=models.CASCADE,
+                                   primary_key=True, related_name='live_generation')
+    generation = models.PositiveIntegerField(default=0)
+    allocated = models.PositiveIntegerField(default=0)
+    published_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Live Generation'
+        verbose_name_plural = 'Live Generations'
 
 
 class Project(models.Model):
@@ -123,6 +273,8 @@ class Project(models.Model):
 
 class CumulativeCost(models.Model):
     # Store the latest cumulative costs
+    account = models.OneToOneField('credman.AWSAccountCredentials', on_delete=models.CASCADE,
+                                   null=True, blank=True)
     ec2_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     rds_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     ebs_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
@@ -137,6 +289,7 @@ class CumulativeCost(models.Model):
 
 class CumulativeCostHistory(models.Model):
     # Historical record of cumulative costs
+    account = account_field()
     ec2_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     rds_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     ebs_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
@@ -145,5 +298,126 @@ class CumulativeCostHistory(models.Model):
     elastic_ips_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     recorded_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['account', 'recorded_at'],
+                                name='rmon_cost_history_idx')]
+
     def __str__(self):
         return f"History as of {self.recorded_at}"
+
+
+class CumulativeCostRollup(models.Model):
+    # CumulativeCostHistory compacted per hour, day or month, see
+    # rmon.helpers.rollups. Sums rather than averages, so that rollups can
+    # be combined into coarser ones.
+    HOUR = 'hour'
+    DAY = 'day'
+    MONTH = 'month'
+    RESOLUTION_CHOICES = [
+        (HOUR, 'Hour'),
+        (DAY, 'Day'),
+        (MONTH, 'Month'),
+    ]
+
+    account = account_field()
+    resolution = models.CharField(max_length=10, choices=RESOLUTION_CHOICES)
+    period_start = models.DateTimeField()
+    samples = models.PositiveIntegerField()
+    ec2_cost_sum = models.DecimalField(max_digits=16, decimal_places=2)
+    ec2_cost_min = models.DecimalField(max_digits=10, decimal_places=2)
+    ec2_cost_max = models.DecimalField(max_digits=10, decimal_places=2)
+    rds_cost_sum = models.DecimalField(max_digits=16, decimal_places=2)
+    rds_cost_min = models.DecimalField(max_digits=10, decimal_places=2)
+    rds_cost_max = models.DecimalField(max_digits=10, decimal_places=2)
+    ebs_cost_sum = models.DecimalField(max_digits=16, decimal_places=2)
+    ebs_cost_min = models.DecimalField(max_digits=10, decimal_places=2)
+    ebs_cost_max = models.DecimalField(max_digits=10, decimal_places=2)
+    rds_snapshots_cost_sum = models.DecimalField(max_digits=16, decimal_places=2)
+    rds_snapshots_cost_min = models.DecimalField(max_digits=10, decimal_places=2)
+    rds_snapshots_cost_max = models.DecimalField(max_digits=10, decimal_places=2)
+    ebs_snapshots_cost_sum = models.DecimalField(max_digits=16, decimal_places=2)
+    ebs_snapshots_cost_min = models.DecimalField(max_digits=10, decimal_places=2)
+    ebs_snapshots_cost_max = models.DecimalField(max_digits=10, decimal_places=2)
+    elastic_ips_cost_sum = models.DecimalField(max_digits=16, decimal_places=2)
+    elastic_ips_cost_min = models.DecimalField(max_digits=10, decimal_places=2)
+    elastic_ips_cost_max = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        verbose_name = 'Cumulative Cost Rollup'
+        verbose_name_plural = 'Cumulative Cost Rollups'
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'resolution', 'period_start'],
+                                    name='rmon_cost_rollup_period'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_resolution_display()} rollup from {self.period_start}"
+
+
+class IngestJob(models.Model):
+    # One refresh of a user's report, run by the refresh_data Celery task
+    PENDING = 'PENDING'
+    STARTED = 'STARTED'
+    SUCCESS = 'SUCCESS'
+    FAILURE = 'FAILURE'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (STARTED, 'Started'),
+        (SUCCESS, 'Success'),
+        (FAILURE, 'Failure'),
+    ]
+    ACTIVE_STATUSES = (PENDING, STARTED)
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    stage = models.CharField(max_length=50, blank=True)
+    progress = models.JSONField(default=dict, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    # Parameters of the refresh; blank mode means RMON_SYNC_MODE
+    force = models.BooleanField(default=False)
+    mode = models.CharField(max_length=20, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Ingest Job'
+        verbose_name_plural = 'Ingest Jobs'
+
+    def __str__(self):
+        return f"Ingest job {self.id} ({self.status})"
+
+
+class RefreshSchedule(models.Model):
+    # Background refresh bookkeeping for one set of stored AWS credentials
+    credentials = models.OneToOneField('credman.AWSAccountCredentials',
+                                       on_delete=models.CASCADE,
+                                       related_name='refresh_schedule')
+    next_run_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    last_run_at = models.DateTimeField(null=True, blank=True)
+    last_success_at = models.DateTimeField(null=True, blank=True)
+    consecutive_failures = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Refresh Schedule'
+        verbose_name_plural = 'Refresh Schedules'
+
+    def __str__(self):
+        return f"Refresh schedule for {self.credentials_id} (next {self.next_run_at})"
+
+
+class ReportSnapshot(models.Model):
+    # Index of the raw reports kept by rmon.helpers.snapshot_store
+    account = models.ForeignKey('credman.AWSAccountCredentials', on_delete=models.CASCADE)
+    digest = models.CharField(max_length=64, db_index=True)
+    size = models.BigIntegerField()
+    stored_size = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Report Snapshot'
+        verbose_name_plural = 'Report Snapshots'
+        indexes = [models.Index(fields=['account', '-created_at'])]
+
+    def __str__(self):
+        return f"Snapshot {self.digest[:12]} for {self.account_id}"
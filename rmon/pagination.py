@@ -0,0 +1,11 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class ResourceCursorPagination(CursorPagination):
+    # Keyset pagination on the primary key: every page is an index range
+    # scan, however deep the client pages
+    ordering = 'id'
+    page_size = settings.RMON_RESOURCE_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.RMON_RESOURCE_MAX_PAGE_SIZE
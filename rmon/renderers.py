@@ -0,0 +1,48 @@
+import re
+
+import orjson
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# orjson writes floats below 1e-4 as 0.00001 or 2.5e-7 and floats from 1e16
+# up as 1e16, where json.dumps writes 1e-05, 2.5e-07 and 1e+16. Such
+# output is found by scanning the rendered bytes; a match inside a string
+# only costs a fallback to JSONRenderer.
+EXPONENT = re.compile(rb'e-?\d+[,\]}]')
+SMALL_FLOAT = re.compile(rb'[\[,:]-?0\.0000')
+
+
+def orjson_differs(content):
+    if b'0.0000' in content and SMALL_FLOAT.search(content):
+        return True
+    for match in EXPONENT.finditer(content):
+        if content[match.start() - 1:match.start()].isdigit():
+            return True
+    return False
+
+
+class FastJSONRenderer(JSONRenderer):
+    # JSON renderer on orjson, enabled by RMON_FAST_JSON. It produces the
+    # same bytes as JSONRenderer and hands anything it cannot match
+    # (indent, non-default JSON settings, the float notations above, types
+    # orjson rejects) to JSONRenderer. Unlike STRICT_JSON it writes NaN and
+    # Infinity as null instead of failing the response.
+    encoder = JSONEncoder()
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context) or \
+                not (self.compact and self.strict and not self.ensure_ascii) or \
+                not isinstance(data, (dict, list, tuple)):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder.default, option=self.options)
+        except (orjson.JSONEncodeError, TypeError):
+            return super().render(data, accepted_media_type, renderer_context)
+        if orjson_differs(ret):
+            return super().render(data, accepted_media_type, renderer_context)
+        # Same escaping of the two line terminators as JSONRenderer
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
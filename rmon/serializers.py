@@ -1,77 +1,93 @@
+from functools import lru_cache
+
 from rest_framework import serializers
+from .helpers.ingest import RESOURCE_TYPES, region_resources
+from .helpers.queries import count_attr
 from .models import IAMUser, S3Bucket, EC2Instance, \
 EBSVolume, RDSSnapshot, ElasticIP, \
-Region, RDSInstance, EC2Snapshot, Project
+Region, RDSInstance, EC2Snapshot, Project, IngestJob, SavingsRanking, \
+SavingsSummary
 class IAMUserSerializer(serializers.ModelSerializer):
     class Meta:
         model = IAMUser
-        fields = '__all__'
+        exclude = ['account', 'generation']
 
 class S3BucketSerializer(serializers.ModelSerializer):
     class Meta:
         model = S3Bucket
-        fields = '__all__'
+        exclude = ['account', 'generation']
 
 class EC2InstanceSerializer(serializers.ModelSerializer):
     class Meta:
         model = EC2Instance
-        fields = '__all__'
+        exclude = ['account', 'generation', 'region_ref']
 
 class RDSInstanceSerializer(serializers.ModelSerializer):
     class Meta:
         model = RDSInstance
-        fields = '__all__'
+        exclude = ['account', 'generation', 'region_ref']
 
 class EBSVolumeSerializer(serializers.ModelSerializer):
     class Meta:
         model = EBSVolume
-        fields = '__all__'
+        exclude = ['account', 'generation', 'region_ref']
 
 class RDSSnapshotSerializer(serializers.ModelSerializer):
     class Meta:
         model = RDSSnapshot
-        fields = '__all__'
+        exclude = ['account', 'generation', 'region_ref']
 
 class EC2SnapshotSerializer(serializers.ModelSerializer):
     class Meta:
         model = EC2Snapshot
-        fields = '__all__'
+        exclude = ['account', 'generation', 'region_ref']
 
 class ElasticIPSerializer(serializers.ModelSerializer):
     class Meta:
         model = ElasticIP
-        fields = '__all__'
+        exclude = ['account', 'generation', 'region_ref']
+
+class RegionResourcesSerializer(serializers.ListSerializer):
+    # A region's resources of one type under either RMON_REGION_SCHEMA
+    def get_attribute(self, instance):
+        rtype = next(rtype for rtype in RESOURCE_TYPES.values()
+                     if rtype.relation == self.field_name)
+        return region_resources(instance, rtype).order_by('pk')
 
 class RegionSerializer(serializers.ModelSerializer):
-    stopped_ec2_instances = EC2InstanceSerializer(many=True)
-    unused_rds_instances = RDSInstanceSerializer(many=True)
-    available_ebs_volumes = EBSVolumeSerializer(many=True)
-    old_rds_snapshots = RDSSnapshotSerializer(many=True)
-    old_ec2_snapshots = EC2SnapshotSerializer(many=True)
-    unused_elastic_ips = ElasticIPSerializer(many=True)
+    stopped_ec2_instances = RegionResourcesSerializer(child=EC2InstanceSerializer())
+    unused_rds_instances = RegionResourcesSerializer(child=RDSInstanceSerializer())
+    available_ebs_volumes = RegionResourcesSerializer(child=EBSVolumeSerializer())
+    old_rds_snapshots = RegionResourcesSerializer(child=RDSSnapshotSerializer())
+    old_ec2_snapshots = RegionResourcesSerializer(child=EC2SnapshotSerializer())
+    unused_elastic_ips = RegionResourcesSerializer(child=ElasticIPSerializer())
 
     class Meta:
         model = Region
-        fields = '__all__'
+        exclude = ['account', 'generation']
 
 class RegionResourceCountSerializer(serializers.ModelSerializer):
     total_resources = serializers.SerializerMethodField()
+    resource_counts = serializers.SerializerMethodField()
 
     class Meta:
         model = Region
-        fields = ['name', 'total_resources']
+        fields = ['name', 'total_resources', 'resource_counts']
+
+    def get_resource_counts(self, obj):
+        # Counts come from with_resource_counts() when the queryset was
+        # annotated, otherwise from one COUNT per resource type
+        counts = {}
+        for rtype in RESOURCE_TYPES.values():
+            count = getattr(obj, count_attr(rtype.name), None)
+            if count is None:
+                count = region_resources(obj, rtype).count()
+            counts[rtype.name] = count
+        return counts
 
     def get_total_resources(self, obj):
         # Calculate the total count of all resources in this region
-        total_count = (
-            obj.stopped_ec2_instances.count() +
-            obj.unused_rds_instances.count() +
-            obj.available_ebs_volumes.count() +
-            obj.old_rds_snapshots.count() +
-            obj.old_ec2_snapshots.count() +
-            obj.unused_elastic_ips.count()
-        )
-        return total_count
+        return sum(self.get_resource_counts(obj).values())
     
 class ResourceDetailSerializer(serializers.Serializer):
     ec2_instances = EC2InstanceSerializer(many=True)
@@ -84,4 +100,70 @@ class ResourceDetailSerializer(serializers.Serializer):
 class ProjectSerializer(serializers.ModelSerializer):
     class Meta:
         model = Project
-        fields = ['project_name', 'account_id']
\ No newline at end of file
+        fields = ['project_name', 'account_id']
+
+class IngestJobSerializer(serializers.ModelSerializer):
+    job_id = serializers.UUIDField(source='id', read_only=True)
+
+    class Meta:
+        model = IngestJob
+        fields = ['job_id', 'status', 'stage', 'progress', 'result', 'force',
+                  'mode', 'created_at', 'finished_at']
+
+
+class SavingsRankingSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SavingsRanking
+        fields = ['rank', 'resource_type', 'resource_id', 'region',
+                  'potential_cost_savings', 'recommendations']
+
+class SavingsSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SavingsSummary
+        fields = ['region', 'resource_type', 'resource_count', 'total_savings',
+                  'max_savings', 'oldest_created']
+
+
+# Resource serializers by the keys used in AllResourcesView responses
+RESOURCE_SERIALIZERS = {
+    'ec2_instances': EC2InstanceSerializer,
+    'rds_instances': RDSInstanceSerializer,
+    'ebs_volumes': EBSVolumeSerializer,
+    'rds_snapshots': RDSSnapshotSerializer,
+    'ec2_snapshots': EC2SnapshotSerializer,
+    'elastic_ips': ElasticIPSerializer,
+}
+
+
+class ValuesSerializer:
+    # Fast path for the flat ModelSerializers above: rows are read with
+    # values() and converted by the serializer's field objects, built once,
+    # instead of one serializer per model instance. The output is the same
+    # as serializer_class(queryset, many=True).data.
+
+    def __init__(self, serializer_class):
+        self.fields = [(field.field_name, field.source, field)
+                       for field in serializer_class()._readable_fields]
+        self.sources = [source for _, source, _ in self.fields]
+
+    def values(self, queryset):
+        return queryset.values(*self.sources)
+
+    def to_representation(self, row):
+        return {
+            name: None if row[source] is None else field.to_representation(row[source])
+            for name, source, field in self.fields
+        }
+
+    def rows(self, queryset):
+        return [self.to_representation(row) for row in self.values(queryset)]
+
+    def iter_rows(self, queryset, chunk_size):
+        # Server-side cursor, for responses that are streamed
+        for row in self.values(queryset).iterator(chunk_size=chunk_size):
+            yield self.to_representation(row)
+
+
+@lru_cache(maxsize=None)
+def values_serializer(serializer_class):
+    return ValuesSerializer(serializer_class)
@@ -0,0 +1,54 @@
+from celery import shared_task
+from django.utils import timezone
+
+from .helpers.refresh import JobProgress, run_refresh
+from .helpers.rollups import compact_cost_history
+from .helpers.scheduler import claim_due_accounts, expire_stale_jobs, \
+    jitter, record_refresh
+from .models import IngestJob
+
+
+@shared_task
+def refresh_data(job_id, force=False, mode=None):
+    job = IngestJob.objects.select_related('user').get(pk=job_id)
+    IngestJob.objects.filter(pk=job.pk).update(status=IngestJob.STARTED)
+
+    progress = JobProgress(job)
+    try:
+        payload, http_status = run_refresh(job.user, progress, force=force, mode=mode)
+    except Exception as e:
+        stage = IngestJob.objects.values_list('stage', flat=True).get(pk=job.pk)
+        progress.fail(stage or 'fetch', str(e))
+        payload, http_status = {"error": str(e)}, 500
+
+    succeeded = http_status < 400
+    IngestJob.objects.filter(pk=job.pk).update(
+        status=IngestJob.SUCCESS if succeeded else IngestJob.FAILURE,
+        result=payload,
+        finished_at=timezone.now(),
+    )
+    record_refresh(job.user, succeeded)
+    return payload
+
+
+@shared_task
+def schedule_refreshes():
+    # Run by celery beat: queue a refresh for every stored account that is
+    # due, spread over RMON_REFRESH_JITTER seconds
+    now = timezone.now()
+    expire_stale_jobs(now)
+
+    queued = []
+    for credentials in claim_due_accounts(now):
+        job = IngestJob.objects.create(user_id=credentials.user_id)
+        refresh_data.apply_async(args=[str(job.pk)], task_id=str(job.pk),
+                                 countdown=jitter())
+        queued.append(str(job.pk))
+    return queued
+
+
+@shared_task
+def compact_costs():
+    # Run by celery beat: roll CumulativeCostHistory into the cost rollups
+    # and apply the retention policy
+    return compact_cost_history()
@@ -1,3 +1,801 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from botocore.exceptions import IncompleteReadError, ReadTimeoutError
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Avg, Count, Max, Min, Sum
+from django.db.transaction import TransactionManagementError
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from credman.models import AWSAccountCredentials
+from .helpers.cache import current_generation, generation_key
+from .helpers.copy_loader import CopyLoader
+from .helpers.ingest import CREATED_FIELDS, GLOBAL_TYPES, RESOURCE_TYPES, SYNC_MODES, \
+    ReportIngest, ingest_report
+from .helpers.fetch_json import NOT_MODIFIED
+from .helpers.refresh import STAGES, JobProgress, run_refresh
+from .helpers.rollups import HOUR, bucketed_costs, compact_cost_history, cost_points
+from .helpers.snapshot_store import SnapshotWriter, record_snapshot, snapshot_path
+from .models import CumulativeCost, CumulativeCostHistory, EC2Instance, IAMUser, \
+    LiveGeneration, Region, ReportSnapshot, SavingsRanking, SavingsSummary
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def create_account(username):
+    user = User.objects.create_user(username, password='pw')
+    return AWSAccountCredentials.objects.create(
+        user=user, aws_access_key_id='AKIA' + username, aws_secret_access_key='secret',
+        aws_region='us-east-1', bucket_name='reports', object_key='report.json')
+
+
+def sample_report(regions=2, count=5, prefix='', savings=10):
+    # A report in the layout fetch_json reads, count resources of every
+    # type per region
+    report = {
+        'account_id': '123456789012', 'project_name': 'sample',
+        'global': {
+            'IAMUsers': [{'UserId': f"{prefix}U{i}", 'UserName': f"user{i}", 'Tags': [],
+                          'LastLogin': 'never'} for i in range(count)],
+            'S3Buckets': [{'BucketName': f"{prefix}bucket{i}", 'CreationDate': '2024-01-01T00:00:00Z',
+                           'Tags': [], 'Status': 'ok'} for i in range(count)],
+            'CumulativeCostOptimization': {
+                'EC2': '12.50 USD', 'RDS': '3.00 USD', 'EBS': '1.00 USD',
+                'RDSSnapshots': '0.50 USD', 'EBSSnapshots': '0.25 USD', 'ElasticIPs': '3.60 USD'},
+        },
+    }
+    for g in range(regions):
+        region = f"us-east-{g + 1}"
+        report[region] = {
+            'StoppedEC2Instances': [{
+                'InstanceId': f"{prefix}i-{g}-{i}", 'InstanceType': 't3.micro',
+                'LaunchTime': '2024-01-01T00:00:00Z', 'Region': region, 'Age': 10,
+                'Tags': [{'Key': 'env', 'Value': 'dev'}], 'Status': 'stopped',
+                'PotentialCostSavings': f"{savings + i}.00 USD", 'Recommendations': 'stop'}
+                for i in range(count)],
+            'UnusedRDSInstances': [{
+                'DBInstanceIdentifier': f"{prefix}db-{g}-{i}", 'DBInstanceClass': 'db.t3.micro',
+                'BackupType': 'auto', 'Region': region,
+                'PotentialCostSavings': f"{savings + i}.50 USD", 'Recommendations': 'delete'}
+                for i in range(count)],
+            'AvailableEBSVolumes': [{
+                'VolumeId': f"{prefix}vol-{g}-{i}", 'Size': 8, 'Region': region, 'Tags': [],
+                'PotentialCostSavings': '0.80 USD', 'Recommendations': 'delete'}
+                for i in range(count)],
+            'OldRDSSnapshots': [{
+                'SnapshotId': f"{prefix}rs-{g}-{i}", 'CreationDate': '2023-01-01T00:00:00Z',
+                'Region': region, 'PotentialCostSavings': '1.00 USD', 'Recommendations': 'delete'}
+                for i in range(count)],
+            'OldEBSSnapshots': [{
+                'SnapshotId': f"{prefix}es-{g}-{i}", 'StartTime': '2023-01-01T00:00:00Z',
+                'Region': region, 'PotentialCostSavings': '1.00 USD', 'Recommendations': 'delete'}
+                for i in range(count)],
+            'AvailableElasticIPs': [{
+                'AllocationId': f"{prefix}eip-{g}-{i}", 'PublicIp': f"10.0.{g}.{i}",
+                'Region': region, 'Tags': [], 'PotentialCostSavings': '3.60 USD',
+                'Recommendations': 'release'}
+                for i in range(count)],
+        }
+    return report
+
+
+def linked_savings(account, region, relation='stopped_ec2_instances'):
+    # Natural key -> savings of the resources linked to one of the
+    # account's regions
+    region = Region.objects.get(account=account, name=region)
+    return {
+        getattr(row, RELATION_KEYS[relation]): row.potential_cost_savings
+        for row in getattr(region, relation).all()
+    }
+
+
+RELATION_KEYS = {'stopped_ec2_instances': 'instance_id',
+                 'unused_rds_instances': 'db_instance_identifier'}
+
+
+def stored_rows(account):
+    # Every resource row without the surrogate and account columns
+    rows = {}
+    for rtype in list(GLOBAL_TYPES.values()) + list(RESOURCE_TYPES.values()):
+        for values in rtype.model.objects.filter(account=account).values():
+            for name in ('id', 'account_id', 'region_ref_id'):
+                values.pop(name, None)
+            rows[(rtype.name, values[rtype.natural_key])] = values
+    return rows
+
+
+def ec2_instance(account, number, **fields):
+    values = {
+        'account': account, 'instance_id': f"i-{number:04d}", 'instance_type': 't3.micro',
+        'launch_time': datetime(2024, 1, 1, tzinfo=dt_timezone.utc), 'region': 'us-east-1',
+        'age': 10, 'tags': [], 'status': 'running', 'potential_cost_savings': 0.0,
+        'recommendations': '',
+    }
+    values.update(fields)
+    return EC2Instance(**values)
+
+
+def record_costs(account, start, count, step=timedelta(minutes=30)):
+    # One history row per step, ec2_cost cycling through 0..9
+    CumulativeCostHistory.objects.bulk_create(
+        CumulativeCostHistory(account=account, ec2_cost=Decimal(i % 10), rds_cost=1)
+        for i in range(count))
+    ids = CumulativeCostHistory.objects.filter(account=account) \
+        .order_by('-id').values_list('id', flat=True)[:count]
+    for i, pk in enumerate(sorted(ids)):
+        CumulativeCostHistory.objects.filter(pk=pk).update(recorded_at=start + i * step)
+
+
+@mock.patch('rmon.views.refresh_data')
+class UpdateDataViewTests(TestCase):
+    url = '/api/rmon/update/'
+
+    def setUp(self):
+        self.account = create_account('alice')
+        self.client = APIClient()
+        self.client.force_authenticate(self.account.user)
+
+    def test_active_job_is_reused_with_the_same_parameters(self, refresh_data):
+        job = self.client.get(self.url, {'mode': 'incremental'})
+        self.assertEqual(job.status_code, 202)
+        self.assertEqual((job.json()['force'], job.json()['mode']), (False, 'incremental'))
+
+        again = self.client.get(self.url, {'mode': 'incremental'})
+        self.assertEqual(again.status_code, 202)
+        self.assertEqual(again.json()['job_id'], job.json()['job_id'])
+
+        for params in ({'mode': 'incremental', 'force': 'true'}, {}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual(response.json()['job']['job_id'], job.json()['job_id'])
+        self.assertEqual(refresh_data.apply_async.call_count, 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHE, RMON_COST_RAW_RETENTION_DAYS=7,
+                   RMON_COST_HOURLY_RETENTION_DAYS=30, RMON_COST_DAILY_RETENTION_DAYS=730)
+class CostPointsTests(TestCase):
+    now = datetime(2025, 6, 15, 12, 30, tzinfo=dt_timezone.utc)
+
+    def setUp(self):
+        cache.clear()
+        self.account = create_account('alice')
+        record_costs(self.account, self.now - timedelta(days=60), 60 * 48)
+
+    def test_compacted_ranges_fall_back_to_rollups(self):
+        start, end = self.now - timedelta(days=61), self.now
+        day = datetime(2025, 4, 17, tzinfo=dt_timezone.utc)
+        expected = CumulativeCostHistory.objects.filter(
+            recorded_at__gte=day, recorded_at__lt=day + timedelta(days=1)
+        ).aggregate(avg=Avg('ec2_cost'))['avg']
+        with self.captureOnCommitCallbacks(execute=True):
+            compact_cost_history(self.now)
+
+        points = cost_points(self.account.pk, start, end)
+        times = [point[0] for point in points]
+        self.assertEqual(times, sorted(set(times)))
+        # Daily averages, then hourly ones, then the raw samples
+        self.assertEqual(times[1] - times[0], timedelta(days=1))
+        self.assertEqual(times[-1] - times[-2], timedelta(minutes=30))
+        self.assertEqual(times[1], day)
+        self.assertEqual(points[1][1:3], (round(expected, 2), Decimal('1.00')))
+        raw = CumulativeCostHistory.objects.filter(account=self.account)
+        self.assertEqual(times[-raw.count():],
+                         list(raw.order_by('recorded_at').values_list('recorded_at', flat=True)))
+
+    def test_compaction_bumps_the_generation(self):
+        generation = current_generation(self.account.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            compact_cost_history(self.now)
+        self.assertNotEqual(current_generation(self.account.pk), generation)
+
+        # Nothing left to compact
+        generation = current_generation(self.account.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            compact_cost_history(self.now)
+        self.assertEqual(current_generation(self.account.pk), generation)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ResourceOrderingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.account = create_account('alice')
+        self.client = APIClient()
+        self.client.force_authenticate(self.account.user)
+
+    def test_cursor_pages_through_ties_once(self):
+        regions = ('us-east-1', 'eu-west-1', 'ap-south-1')
+        EC2Instance.objects.bulk_create(
+            ec2_instance(self.account, number, region=regions[number % 3],
+                         potential_cost_savings=float(number % 4))
+            for number in range(30))
+
+        for ordering in ('region', '-potential_cost_savings'):
+            seen = []
+            url = f'/api/rmon/resources/ec2_instances/?ordering={ordering}&page_size=4'
+            while url:
+                data = self.client.get(url).json()
+                seen.extend(row['instance_id'] for row in data['results'])
+                url = data['next']
+            expected = EC2Instance.objects.order_by(
+                ordering, '-id' if ordering.startswith('-') else 'id')
+            self.assertEqual(seen, list(expected.values_list('instance_id', flat=True)))
+
+    @skipUnless(connection.vendor == 'postgresql', "Index names and EXPLAIN are PostgreSQL's")
+    def test_filters_can_use_indexes(self):
+        # Several accounts, so that the account's own rows are a small part
+        # of the table
+        accounts = [self.account] + [create_account(f"user{n}") for n in range(9)]
+        EC2Instance.objects.bulk_create(
+            ec2_instance(account, number, region=f'region-{number % 20}',
+                         tags=[{'Key': 'team', 'Value': f'team-{number % 500}'}])
+            for account in accounts for number in range(1000))
+        rows = EC2Instance.objects.filter(account=self.account, generation=0)
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {EC2Instance._meta.db_table}")
+        self.assertIn('rmon_ec2_region_idx', rows.filter(region='region-3').explain())
+        # Within one account the planner reaches the rows through the
+        # account index and filters the tags there
+        self.assertNotIn('Seq Scan', rows.filter(
+            tags__contains=[{'Key': 'team', 'Value': 'team-7'}]).explain())
+
+
+@override_settings(CACHES=LOCMEM_CACHE, RMON_INGEST_WORKERS=1,
+                   RMON_SNAPSHOT_GENERATIONS=False, RMON_REGION_SCHEMA='m2m')
+class IngestTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.account = create_account('alice')
+
+    def ingest(self, report, mode, account=None):
+        account = account or self.account
+        with self.captureOnCommitCallbacks(execute=True):
+            return ingest_report(report, account.user, mode=mode)
+
+    def test_replace_round_trip(self):
+        summary = self.ingest(sample_report(), 'replace')
+        self.assertEqual(summary['counts']['ec2_instances'], 10)
+        self.assertEqual(summary['counts']['iam_users'], 5)
+        self.assertEqual(linked_savings(self.account, 'us-east-1'),
+                         {f"i-0-{i}": 10.0 + i for i in range(5)})
+        instance = EC2Instance.objects.get(account=self.account, instance_id='i-1-2')
+        self.assertEqual((instance.region, instance.tags, instance.status),
+                         ('us-east-2', [{'Key': 'env', 'Value': 'dev'}], 'stopped'))
+        self.assertEqual(CumulativeCost.objects.get(account=self.account).ec2_cost,
+                         Decimal('12.50'))
+
+        # Fewer resources and new savings: rows are updated in place and the
+        # region links follow the report
+        self.ingest(sample_report(regions=1, count=3, savings=20), 'replace')
+        self.assertEqual(linked_savings(self.account, 'us-east-1'),
+                         {f"i-0-{i}": 20.0 + i for i in range(3)})
+        self.assertEqual(IAMUser.objects.filter(account=self.account).count(), 3)
+        self.assertEqual(EC2Instance.objects.filter(account=self.account,
+                                                    instance_id='i-0-0').count(), 1)
+
+    def test_incremental_round_trip(self):
+        summary = self.ingest(sample_report(), 'incremental')
+        self.assertEqual(summary['changes']['ec2_instances'],
+                         {'added': 10, 'changed': 0, 'removed': 0})
+
+        summary = self.ingest(sample_report(), 'incremental')
+        self.assertEqual(summary['changes']['ec2_instances'],
+                         {'added': 0, 'changed': 0, 'removed': 0})
+
+        summary = self.ingest(sample_report(regions=1, count=3, savings=20), 'incremental')
+        self.assertEqual(summary['changes']['ec2_instances'],
+                         {'added': 0, 'changed': 3, 'removed': 7})
+        self.assertEqual(linked_savings(self.account, 'us-east-1'),
+                         {f"i-0-{i}": 20.0 + i for i in range(3)})
+        self.assertEqual(
+            set(EC2Instance.objects.filter(account=self.account)
+                .values_list('instance_id', flat=True)),
+            {'i-0-0', 'i-0-1', 'i-0-2'})
+
+    def test_modes_store_the_same_rows(self):
+        other = create_account('bob')
+        self.ingest(sample_report(), 'replace')
+        self.ingest(sample_report(), 'incremental', account=other)
+
+        def stored(account):
+            return list(EC2Instance.objects.filter(account=account).order_by('instance_id')
+                        .values_list('instance_id', 'instance_type', 'launch_time', 'region',
+                                     'age', 'tags', 'status', 'potential_cost_savings',
+                                     'recommendations'))
+        self.assertEqual(stored(self.account), stored(other))
+
+    @override_settings(RMON_SAVINGS_RANKING_SIZE=4)
+    def test_ranking_lists_resources_once(self):
+        # The same instances listed in both regions
+        report = sample_report()
+        report['us-east-2']['StoppedEC2Instances'] = [
+            dict(instance, Region='us-east-2')
+            for instance in report['us-east-1']['StoppedEC2Instances']]
+        self.ingest(report, 'replace')
+
+        ranking = list(SavingsRanking.objects.filter(account=self.account)
+                       .order_by('rank').values_list('resource_id', 'potential_cost_savings'))
+        self.assertEqual(ranking, [('db-1-4', 14.5), ('db-0-4', 14.5),
+                                   ('i-0-4', 14.0), ('db-1-3', 13.5)])
+
+    def test_generations_off_publishes_nothing(self):
+        self.ingest(sample_report(), 'replace')
+        self.assertFalse(LiveGeneration.objects.filter(account=self.account).exists())
+
+    def test_turning_generations_off_reads_generation_zero(self):
+        with override_settings(RMON_SNAPSHOT_GENERATIONS=True):
+            self.ingest(sample_report(), 'replace')
+            self.ingest(sample_report(savings=20), 'replace')
+            self.assertEqual(LiveGeneration.objects.get(account=self.account).generation, 2)
+        self.ingest(sample_report(savings=40), 'replace')
+
+        client = APIClient()
+        client.force_authenticate(self.account.user)
+        listed = client.get('/api/rmon/resources/ec2_instances/?page_size=100').json()
+        self.assertEqual(len(listed['results']), 10)
+        self.assertEqual(min(row['potential_cost_savings'] for row in listed['results']), 40.0)
+
+    def aggregated(self, account):
+        # The summary computed from the resources linked to each region; a
+        # replace run leaves rows of earlier runs in the tables, unlinked
+        summary = {}
+        for region in Region.objects.filter(account=account):
+            for rtype in RESOURCE_TYPES.values():
+                aggregates = {'count': Count('pk'), 'total': Sum('potential_cost_savings'),
+                              'largest': Max('potential_cost_savings')}
+                if rtype.name in CREATED_FIELDS:
+                    aggregates['oldest'] = Min(CREATED_FIELDS[rtype.name])
+                row = getattr(region, rtype.relation).aggregate(**aggregates)
+                if row['count']:
+                    summary[(region.name, rtype.name)] = (
+                        row['count'], round(row['total'], 2), row['largest'], row.get('oldest'))
+        return summary
+
+    def test_summary_matches_the_resource_tables(self):
+        for mode in SYNC_MODES:
+            account = create_account(f"user-{mode}")
+            self.ingest(sample_report(), 'replace', account=account)
+            # Updates, inserts and deletes rows of the first run
+            self.ingest(sample_report(regions=3, count=3, savings=20), mode, account=account)
+
+            expected = self.aggregated(account)
+            stored = SavingsSummary.objects.filter(account=account)
+            self.assertEqual({(row.region, row.resource_type): (
+                row.resource_count, row.total_savings, row.max_savings, row.oldest_created)
+                for row in stored}, expected)
+
+            client = APIClient()
+            client.force_authenticate(account.user)
+            listed = client.get('/api/rmon/savings-summary/').json()
+            self.assertEqual({(row['region'], row['resource_type']): (
+                row['resource_count'], row['total_savings'], row['max_savings'])
+                for row in listed}, {key: values[:3] for key, values in expected.items()})
+
+    def test_accounts_are_isolated(self):
+        other = create_account('bob')
+        self.ingest(sample_report(prefix='a-'), 'replace')
+        self.ingest(sample_report(prefix='b-', savings=50), 'incremental', account=other)
+        # bob's next run no longer mentions anything: only his rows go
+        self.ingest(sample_report(regions=1, count=1, prefix='b-'), 'incremental',
+                    account=other)
+
+        self.assertEqual(EC2Instance.objects.filter(account=self.account).count(), 10)
+        self.assertEqual(linked_savings(self.account, 'us-east-1'),
+                         {f"a-i-0-{i}": 10.0 + i for i in range(5)})
+
+        client = APIClient()
+        client.force_authenticate(self.account.user)
+        listed = client.get('/api/rmon/resources/ec2_instances/?page_size=100').json()
+        self.assertEqual(len(listed['results']), 10)
+        self.assertTrue(all(row['instance_id'].startswith('a-') for row in listed['results']))
+        ranked = client.get('/api/rmon/top-savings/?limit=500').json()
+        self.assertTrue(ranked)
+        self.assertTrue(all(row['resource_id'].startswith('a-') for row in ranked))
+
+        client.force_authenticate(other.user)
+        listed = client.get('/api/rmon/resources/ec2_instances/?page_size=100').json()
+        self.assertEqual([row['instance_id'] for row in listed['results']], ['b-i-0-0'])
+
+
+@override_settings(CACHES=LOCMEM_CACHE, RMON_INGEST_WORKERS=1,
+                   RMON_SNAPSHOT_GENERATIONS=False)
+class ConditionalGetTests(TestCase):
+    url = '/api/rmon/resources/ec2_instances/'
+
+    def setUp(self):
+        cache.clear()
+        self.account = create_account('alice')
+        self.client = APIClient()
+        self.client.force_authenticate(self.account.user)
+
+    def ingest(self, report):
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_report(report, self.account.user)
+
+    def test_not_modified_until_the_next_ingest(self):
+        self.ingest(sample_report())
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        self.ingest(sample_report(savings=30))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['results'][0]['potential_cost_savings'], 30.0)
+
+    def test_evicted_generation_does_not_revive_stale_entries(self):
+        self.ingest(sample_report())
+        cache.delete(generation_key(self.account.pk))
+        stale = self.client.get(self.url)
+        self.ingest(sample_report(savings=30))
+        cache.delete(generation_key(self.account.pk))
+
+        response = self.client.get(self.url)
+        self.assertNotEqual(response['ETag'], stale['ETag'])
+        self.assertEqual(response.json()['results'][0]['potential_cost_savings'], 30.0)
+
+    @override_settings(RMON_SNAPSHOT_GENERATIONS=True)
+    def test_ingest_between_scope_and_cache_generation(self):
+        self.ingest(sample_report())
+        read = current_generation
+        ingested = []
+
+        def ingest_first(account_id):
+            # Commits and bumps after the request resolved its snapshot
+            if not ingested:
+                ingested.append(self.ingest(sample_report(savings=30)))
+            return read(account_id)
+
+        with mock.patch('rmon.helpers.cache.current_generation', side_effect=ingest_first):
+            stale = self.client.get(self.url)
+        self.assertEqual(stale.json()['results'][0]['potential_cost_savings'], 10.0)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=stale['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['potential_cost_savings'], 30.0)
+
+    def test_etags_are_per_account(self):
+        other = create_account('bob')
+        self.ingest(sample_report())
+        etag = self.client.get(self.url)['ETag']
+
+        self.client.force_authenticate(other.user)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(CACHES=LOCMEM_CACHE, RMON_COST_RAW_RETENTION_DAYS=3,
+                   RMON_COST_HOURLY_RETENTION_DAYS=20, RMON_COST_DAILY_RETENTION_DAYS=730)
+class RollupTests(TestCase):
+    now = datetime(2025, 6, 15, 12, 30, tzinfo=dt_timezone.utc)
+
+    def setUp(self):
+        self.account = create_account('alice')
+        record_costs(self.account, self.now - timedelta(days=75), 75 * 24 * 3,
+                     step=timedelta(minutes=20))
+
+    def bucketed(self, bucket):
+        start, end = self.now - timedelta(days=80), self.now
+        return [
+            {name: round(value, 6) if isinstance(value, (Decimal, float)) else value
+             for name, value in point.items()}
+            for point in bucketed_costs(self.account.pk, start, end, bucket)
+        ]
+
+    def test_rollups_merge_like_the_raw_rows(self):
+        buckets = ('day', 'week', 'month')
+        raw = {bucket: self.bucketed(bucket) for bucket in buckets}
+        raw_hours = self.bucketed('hour')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result = compact_cost_history(self.now)
+        self.assertGreater(result['deleted']['raw'], 0)
+        self.assertGreater(result['deleted'][HOUR], 0)
+
+        for bucket in buckets:
+            self.assertEqual(self.bucketed(bucket), raw[bucket], bucket)
+        # Hours older than the hourly retention are only in daily rollups
+        # now; the ones after it are unchanged
+        hours = self.bucketed('hour')
+        self.assertEqual(hours, raw_hours[-len(hours):])
+
+    def test_compaction_is_idempotent(self):
+        compact_cost_history(self.now)
+        day = self.bucketed('day')
+        result = compact_cost_history(self.now)
+        self.assertEqual(sum(result['created'].values()), 0)
+        self.assertEqual(self.bucketed('day'), day)
+
+
+@skipUnless(connection.vendor == 'postgresql', "COPY needs PostgreSQL")
+@override_settings(CACHES=LOCMEM_CACHE, RMON_INGEST_WORKERS=1,
+                   RMON_SNAPSHOT_GENERATIONS=False, RMON_SYNC_MODE='replace')
+class CopyLoaderTests(TestCase):
+
+    def ingest(self, account, loader, report):
+        with override_settings(RMON_INGEST_LOADER=loader):
+            ingest_report(report, account.user)
+
+    def test_copy_stores_the_same_rows_as_the_orm(self):
+        orm, copy = create_account('alice'), create_account('bob')
+        for report in (sample_report(), sample_report(regions=3, count=4, savings=20)):
+            self.ingest(orm, 'orm', report)
+            self.ingest(copy, 'copy', report)
+            self.assertEqual(stored_rows(copy), stored_rows(orm))
+        for relation in RELATION_KEYS:
+            self.assertEqual(linked_savings(copy, 'us-east-3', relation),
+                             linked_savings(orm, 'us-east-3', relation))
+
+    def test_upsert_outside_a_transaction_is_refused(self):
+        account = create_account('alice')
+        with mock.patch.object(connection, 'in_atomic_block', False), \
+                self.assertRaises(TransactionManagementError):
+            CopyLoader().upsert(EC2Instance, [{'account_id': account.pk, 'instance_id': 'i-1'}],
+                                ['account', 'generation', 'instance_id'])
+
+
+@skipUnless(connection.vendor == 'postgresql', "Parallel ingest needs PostgreSQL")
+@override_settings(CACHES=LOCMEM_CACHE, RMON_SNAPSHOT_GENERATIONS=False,
+                   RMON_SYNC_MODE='replace')
+class ParallelIngestTests(TransactionTestCase):
+    # Workers write on their own connections, so their rows have to be
+    # committed for real
+
+    def ranked(self, account):
+        return sorted(SavingsRanking.objects.filter(account=account)
+                      .values_list('resource_type', 'resource_id', 'potential_cost_savings'))
+
+    def test_parallel_stores_the_same_rows_as_the_serial_ingest(self):
+        serial, parallel = create_account('alice'), create_account('bob')
+        for report in (sample_report(regions=3), sample_report(regions=4, count=3, savings=20)):
+            ingest_report(report, serial.user, workers=1)
+            ingest_report(report, parallel.user, workers=3)
+            self.assertEqual(stored_rows(parallel), stored_rows(serial))
+            self.assertEqual(self.ranked(parallel), self.ranked(serial))
+        for relation in RELATION_KEYS:
+            self.assertEqual(linked_savings(parallel, 'us-east-4', relation),
+                             linked_savings(serial, 'us-east-4', relation))
+
+    def test_one_failing_worker_rolls_every_worker_back(self):
+        account = create_account('alice')
+        ingest_report(sample_report(regions=3), account.user, workers=3)
+        before = stored_rows(account)
+        feed = ReportIngest.feed
+
+        def failing_feed(ingest, section, key, value):
+            if section == 'us-east-2':
+                raise ValueError("broken region")
+            return feed(ingest, section, key, value)
+
+        with mock.patch.object(ReportIngest, 'feed', failing_feed), \
+                self.assertRaises(RuntimeError):
+            ingest_report(sample_report(regions=3, savings=30), account.user, workers=3)
+
+        self.assertEqual(stored_rows(account), before)
+
+
+class SnapshotTestCase(TestCase):
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        settings_override = override_settings(
+            CACHES=LOCMEM_CACHE, RMON_INGEST_WORKERS=1, RMON_SNAPSHOT_GENERATIONS=False,
+            RMON_SNAPSHOT_ROOT=root.name, RMON_SNAPSHOT_KEEP=1)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+
+
+class SnapshotStoreTests(SnapshotTestCase):
+
+    def record(self, account, content):
+        with SnapshotWriter() as writer:
+            writer.write(content)
+            return record_snapshot(account, writer)
+
+    def test_shared_files_outlive_one_accounts_snapshots(self):
+        alice, bob = create_account('alice'), create_account('bob')
+        shared = self.record(alice, b'{"same": "report"}')
+        self.record(bob, b'{"same": "report"}')
+
+        # Keeping one snapshot per account prunes alice's first one
+        self.record(alice, b'{"newer": "report"}')
+        self.assertEqual(ReportSnapshot.objects.filter(account=alice).count(), 1)
+        self.assertTrue(os.path.exists(snapshot_path(shared.digest)))
+
+        self.record(bob, b'{"newer": "report"}')
+        self.assertFalse(os.path.exists(snapshot_path(shared.digest)))
+        self.assertEqual(ReportSnapshot.objects.filter(digest=shared.digest).count(), 0)
+
+
+@override_settings(RMON_INGEST_STREAMING=True)
+class RefreshTests(SnapshotTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.account = create_account('alice')
+        self.report = json.dumps(sample_report()).encode()
+        self.etag = '"v1"'
+        self.last_modified = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+
+    def refresh(self, progress=None, body=None, force=False):
+        # S3 answers 304 when the request carries the report's ETag
+        def open_json(*args, etag=None, last_modified=None):
+            if etag == self.etag:
+                return NOT_MODIFIED, True
+            return ({'Body': body or io.BytesIO(self.report), 'ETag': self.etag,
+                     'LastModified': self.last_modified,
+                     'ContentLength': len(self.report)}, True)
+
+        with mock.patch('rmon.helpers.refresh.open_json', side_effect=open_json) as fetch, \
+                self.captureOnCommitCallbacks(execute=True):
+            result = run_refresh(self.account.user, progress, force=force)
+        self.fetched_with = fetch.call_args.kwargs['etag']
+        return result
+
+    def test_refresh_keeps_a_snapshot(self):
+        payload, status = self.refresh()
+        self.assertEqual(status, 200)
+        snapshot = ReportSnapshot.objects.get(account=self.account)
+        self.assertEqual(payload['snapshot'], snapshot.digest)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.report_etag, '"v1"')
+
+    def test_unchanged_report_is_not_ingested_again(self):
+        self.refresh()
+        progress = JobProgress()
+        with mock.patch('rmon.helpers.refresh.ingest_events') as ingest_events:
+            payload, status = self.refresh(progress)
+
+        ingest_events.assert_not_called()
+        self.assertEqual(self.fetched_with, '"v1"')
+        self.assertTrue(payload['not_modified'])
+        self.assertEqual(progress.progress['fetch']['state'], 'done')
+        self.assertEqual([progress.progress[stage]['state'] for stage in STAGES[1:]],
+                         ['skipped'] * 3)
+        self.account.refresh_from_db()
+        self.assertEqual((self.account.report_etag, self.account.report_last_modified),
+                         ('"v1"', datetime(2025, 1, 1, tzinfo=dt_timezone.utc)))
+
+        # The report changed on S3
+        self.etag, self.last_modified = '"v2"', datetime(2025, 1, 2, tzinfo=dt_timezone.utc)
+        self.report = json.dumps(sample_report(savings=30)).encode()
+        payload, status = self.refresh()
+
+        self.assertEqual(self.fetched_with, '"v1"')
+        self.assertEqual(payload['counts']['ec2_instances'], 10)
+        self.assertEqual(EC2Instance.objects.get(account=self.account, instance_id='i-0-0')
+                         .potential_cost_savings, 30.0)
+        self.account.refresh_from_db()
+        self.assertEqual((self.account.report_etag, self.account.report_last_modified),
+                         ('"v2"', self.last_modified))
+
+    @override_settings(RMON_INGEST_STREAMING=False)
+    def test_buffered_refresh(self):
+        payload, status = self.refresh()
+        self.assertEqual(status, 200)
+        self.assertEqual(payload['counts']['ec2_instances'], 10)
+        self.assertTrue(ReportSnapshot.objects.filter(account=self.account).exists())
+
+        progress = JobProgress()
+        payload, status = self.refresh(progress, body=io.BytesIO(b'{"broken'), force=True)
+        self.assertEqual(status, 401)
+        self.assertEqual(progress.progress['parse']['state'], 'failed')
+
+    def test_snapshot_failure_does_not_fail_the_refresh(self):
+        progress = JobProgress()
+        with mock.patch('rmon.helpers.refresh.record_snapshot', side_effect=OSError('disk full')), \
+                self.assertLogs('rmon.helpers.refresh', 'ERROR'):
+            payload, status = self.refresh(progress)
+
+        self.assertEqual(status, 200)
+        self.assertIsNone(payload['snapshot'])
+        self.assertEqual(progress.progress['store'], {'state': 'failed', 'error': 'disk full'})
+        self.assertEqual(EC2Instance.objects.filter(account=self.account).count(), 10)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.report_etag, '"v1"')
+
+    def test_broken_downloads_are_reported(self):
+        errors = (ReadTimeoutError(endpoint_url='https://s3.amazonaws.com'),
+                  IncompleteReadError(actual_bytes=100, expected_bytes=len(self.report)))
+        for streaming in (True, False):
+            for error in errors:
+                with self.subTest(streaming=streaming, error=type(error).__name__), \
+                        override_settings(RMON_INGEST_STREAMING=streaming):
+                    progress = JobProgress()
+                    payload, status = self.refresh(progress, BrokenBody(self.report[:100], error))
+
+                    self.assertEqual(status, 502)
+                    self.assertEqual(progress.progress['fetch']['state'], 'failed')
+                    self.assertFalse(EC2Instance.objects.filter(account=self.account).exists())
+                    self.account.refresh_from_db()
+                    self.assertEqual(self.account.report_etag, '')
+
+
+    def test_accounts_without_rows_ignore_the_stored_etag(self):
+        # Validators left from rows that were purged since
+        AWSAccountCredentials.objects.filter(pk=self.account.pk).update(report_etag='"v1"')
+
+        payload, status = self.refresh()
+
+        self.assertIsNone(self.fetched_with)
+        self.assertEqual(status, 200)
+        self.assertEqual(EC2Instance.objects.filter(account=self.account).count(), 10)
+
+
+    def test_turning_generations_off_downloads_the_report_again(self):
+        self.refresh()
+        with override_settings(RMON_SNAPSHOT_GENERATIONS=True):
+            self.refresh(force=True)
+            # Publishing generation 2 collects generation 0
+            self.refresh(force=True)
+        self.assertFalse(EC2Instance.objects.filter(account=self.account, generation=0).exists())
+
+        payload, status = self.refresh()
+
+        self.assertIsNone(self.fetched_with)
+        self.assertEqual(status, 200)
+        self.assertEqual(LiveGeneration.objects.get(account=self.account).generation, 0)
+        client = APIClient()
+        client.force_authenticate(self.account.user)
+        listed = client.get('/api/rmon/resources/ec2_instances/?page_size=100').json()
+        self.assertEqual(len(listed['results']), 10)
+
+        # Turned on again, readers stay on generation 0 until the next run
+        with override_settings(RMON_SNAPSHOT_GENERATIONS=True):
+            payload, status = self.refresh()
+        self.assertEqual(self.fetched_with, '"v1"')
+        self.assertTrue(payload['not_modified'])
+
+
+class BrokenBody:
+    # S3 body whose connection drops after the first chunk
+
+    def __init__(self, chunk, error):
+        self.chunk = chunk
+        self.error = error
+
+    def read(self, size=-1):
+        if self.chunk is None:
+            raise self.error
+        chunk, self.chunk = self.chunk, None
+        if size < 0:
+            raise self.error
+        return chunk
+
+    def close(self):
+        pass
+
+
+class BackfillRegionRefsTests(TestCase):
+
+    def test_links_fill_only_missing_refs(self):
+        account = create_account('alice')
+        east, west = (Region.objects.create(account=account, name=name)
+                      for name in ('us-east-1', 'us-west-2'))
+        linked = ec2_instance(account, 1)
+        written_by_fk = ec2_instance(account, 2, region='us-west-2', region_ref=west)
+        EC2Instance.objects.bulk_create([linked, written_by_fk])
+        east.stopped_ec2_instances.add(EC2Instance.objects.get(instance_id='i-0001'))
+
+        call_command('backfill_region_refs', stdout=io.StringIO())
+
+        refs = dict(EC2Instance.objects.values_list('instance_id', 'region_ref'))
+        self.assertEqual(refs, {'i-0001': east.pk, 'i-0002': west.pk})
@@ -5,13 +5,17 @@ from .views import UpdateDataView, IAMUserListView, \
     S3BucketListView, RegionDetailView, \
     TotalResourceCountView, AllResourcesView, \
     FetchAccountDetailsView, LatestCumulativeCostView, \
-        CumulativeCostRangeView
+        CumulativeCostRangeView, IngestJobStatusView, \
+        ResourceListView, TopSavingsView, SavingsSummaryView
 
 
 app_name = 'rmon'
 
 urlpatterns = [
     path('update/', UpdateDataView.as_view(), name='update-data'),
+
+    path('jobs/<uuid:job_id>/', IngestJobStatusView.as_view(),
+    name='ingest-job-status'),
     
     path('iam-users/', IAMUserListView.as_view(), name='iam-user-list'),
 
@@ -27,6 +31,12 @@ urlpatterns = [
     path('all-resources/', AllResourcesView.as_view(), 
     name='all-resources'),
 
+    path('resources/<str:resource_type>/', ResourceListView.as_view(),
+    name='resource-list'),
+
+    path('top-savings/', TopSavingsView.as_view(), name='top-savings'),
+    path('savings-summary/', SavingsSummaryView.as_view(), name='savings-summary'),
+
     path('account-details/', FetchAccountDetailsView.as_view(), 
     name='fetch_account_details'),
 
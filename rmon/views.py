@@ -1,32 +1,41 @@
-import os
-import json
-
 from django.conf import settings
 from django.utils import timezone
 from django.utils.dateparse import parse_datetime
 from django.utils.dateformat import format
 from rest_framework.generics import ListAPIView, RetrieveAPIView
-from rest_framework import filters
-from django.http import Http404
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.exceptions import ValidationError
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.pagination import PageNumberPagination
-from django.core.files.storage import FileSystemStorage
 from rest_framework.permissions import IsAuthenticated
 from rest_framework_simplejwt.authentication import JWTAuthentication
 
-from .helpers.fetch_json import fetch_json as fj
+from .helpers.accounts import request_scope, scoped
+from .helpers.cache import conditional_get, generation_cached
+from .helpers.ingest import SYNC_MODES
+from .helpers.queries import COST_BUCKETS, COST_FIELDS, bucket_count, \
+with_resource_counts
+from .helpers.rollups import bucketed_costs, cost_points
+from .helpers.refresh import run_refresh
+from .helpers.regions import region_data, region_document
+from .tasks import refresh_data
 from .models import IAMUser, S3Bucket, EC2Instance, \
 EBSVolume, RDSSnapshot, ElasticIP, \
 Region, RDSInstance, EC2Snapshot, Project, \
-CumulativeCost,CumulativeCostHistory
+CumulativeCost, IngestJob, SavingsRanking, SavingsSummary
 
 from .serializers import IAMUserSerializer, S3BucketSerializer, \
 RegionSerializer, RegionResourceCountSerializer, ResourceDetailSerializer, \
 EC2InstanceSerializer, RDSInstanceSerializer, EBSVolumeSerializer, \
 RDSSnapshotSerializer, EC2SnapshotSerializer, ElasticIPSerializer, \
-ProjectSerializer
+ProjectSerializer, IngestJobSerializer, SavingsRankingSerializer, \
+SavingsSummarySerializer, \
+RESOURCE_SERIALIZERS, values_serializer
+from .filters import ResourceFilter, ResourceOrderingFilter
+from .pagination import ResourceCursorPagination
 
 from credman.models import AWSAccountCredentials as aac
 
@@ -35,248 +44,124 @@ class UpdateDataView(APIView):
     authentication_classes = [JWTAuthentication]
 
     def get(self, request, *args, **kwargs):
+        # ?force=true downloads and ingests the report even if its ETag is
+        # unchanged, ?mode=replace|incremental overrides RMON_SYNC_MODE and
+        # ?sync=true keeps the old in-request refresh
+        force = request.query_params.get('force', '').lower() in ('1', 'true')
+        mode = request.query_params.get('mode')
+        if mode is not None and mode not in SYNC_MODES:
+            return Response({"error": f"mode must be one of {', '.join(SYNC_MODES)}."},
+             status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            # Retrieve AWS credentials for the user from the credman app
-            aws_credentials = aac.objects.get(user=request.user)
-        except aac.DoesNotExist:
+        if request.query_params.get('sync', '').lower() in ('1', 'true'):
+            payload, http_status = run_refresh(request.user, force=force, mode=mode)
+            return Response(payload, status=http_status)
+
+        if not aac.objects.filter(user=request.user).exists():
             return Response({"error": "No AWS credentials found for the user."},
              status=status.HTTP_400_BAD_REQUEST)
 
-        aws_access_key_id = aws_credentials.aws_access_key_id
-        aws_secret_access_key = aws_credentials.aws_secret_access_key
-        aws_region = aws_credentials.aws_region
-        bucket_name = aws_credentials.bucket_name
-        object_key = aws_credentials.object_key
-
-        (data, fetch_status) = fj(aws_access_key_id, 
-                                  aws_secret_access_key, 
-                                  aws_region, 
-                                  bucket_name, 
-                                  object_key)
-        
-        if fetch_status:
-            fs = FileSystemStorage(location=settings.STATIC_ROOT)
-            directory = 'data'
-
-            file_path = os.path.join(directory, 'data.json')
-            full_directory_path = os.path.join(settings.STATIC_ROOT, directory)
-            if not os.path.exists(full_directory_path):
-                os.makedirs(full_directory_path)
-
-            with fs.open(file_path, 'w') as file:
-                file.write(data)
-
-            json_data = json.loads(data)
-
-            # Update IAM Users
-            IAMUser.objects.all().delete()  # Clear existing records
-            for user in json_data.get("global", {}).get("IAMUsers", []):
-                IAMUser.objects.create(
-                    user_id=user["UserId"],
-                    user_name=user["UserName"],
-                    tags=user["Tags"],
-                    last_login=user["LastLogin"]
-                )
-
-            # Update S3 Buckets
-            S3Bucket.objects.all().delete()  # Clear existing records
-            for bucket in json_data.get("global", {}).get("S3Buckets", []):
-                S3Bucket.objects.create(
-                    bucket_name=bucket["BucketName"],
-                    creation_date=bucket["CreationDate"],
-                    tags=bucket["Tags"],
-                    status=bucket["Status"],
-                )
-
-            self.update_cumulative_cost(json_data)
-
-            # Update resources per region
-            for region_name, resources in json_data.items():
-                if region_name in ["global", "account_id", "project_name"]:
-                    continue
-
-                region, created = Region.objects.get_or_create(name=region_name)
-
-                # Process each resource type
-                self.update_ec2_instances(region, resources)
-                self.update_rds_instances(region, resources)
-                self.update_ebs_volumes(region, resources)
-                self.update_rds_snapshots(region, resources)
-                self.update_ec2_snapshots(region, resources)
-                self.update_elastic_ips(region, resources)
-
-            # Save project data
-            self.update_project_data(request.user, json_data)
-
-            return Response({"message": "Data saved successfully."}, status=200)
-        
-        else:
-            return Response({"data": data}, status=status.HTTP_401_UNAUTHORIZED)
-
-    def update_project_data(self, user, json_data):
-        # Clear existing project records for the user
-        Project.objects.filter(user=user).delete()
-        Project.objects.create(
-            user=user,
-            project_name=json_data["project_name"],
-            account_id=json_data["account_id"]
-        )
-
-    def update_cumulative_cost(self, json_data):
-        # Extract cumulative costs
-        cumulative_cost_data = json_data.get("global", {}).get("CumulativeCostOptimization", {})
-        ec2_cost = cumulative_cost_data.get("EC2", "0.00 USD").replace(" USD", "")
-        rds_cost = cumulative_cost_data.get("RDS", "0.00 USD").replace(" USD", "")
-        ebs_cost = cumulative_cost_data.get("EBS", "0.00 USD").replace(" USD", "")
-        rds_snapshots_cost = cumulative_cost_data.get("RDSSnapshots", "0.00 USD").replace(" USD", "")
-        ebs_snapshots_cost = cumulative_cost_data.get("EBSSnapshots", "0.00 USD").replace(" USD", "")
-        elastic_ips_cost = cumulative_cost_data.get("ElasticIPs", "0.00 USD").replace(" USD", "")
-
-        # Save current cost to history
-        CumulativeCostHistory.objects.create(
-            ec2_cost=ec2_cost,
-            rds_cost=rds_cost,
-            ebs_cost=ebs_cost,
-            rds_snapshots_cost=rds_snapshots_cost,
-            ebs_snapshots_cost=ebs_snapshots_cost,
-            elastic_ips_cost=elastic_ips_cost
-        )
-
-        # Update latest cumulative cost
-        CumulativeCost.objects.update_or_create(
-            defaults={
-                'ec2_cost': ec2_cost,
-                'rds_cost': rds_cost,
-                'ebs_cost': ebs_cost,
-                'rds_snapshots_cost': rds_snapshots_cost,
-                'ebs_snapshots_cost': ebs_snapshots_cost,
-                'elastic_ips_cost': elastic_ips_cost
-            }
-        )
-
-    def update_ec2_instances(self, region, resources):
-        # Stopped EC2 Instances
-        region.stopped_ec2_instances.clear()
-        for ec2_instance in resources.get("StoppedEC2Instances", []):
-            instance, _ = EC2Instance.objects.get_or_create(
-                instance_id=ec2_instance["InstanceId"],
-                defaults={
-                    "instance_type": ec2_instance["InstanceType"],
-                    "launch_time": ec2_instance["LaunchTime"],
-                    "region": ec2_instance["Region"],
-                    "age": ec2_instance["Age"],
-                    "tags": ec2_instance["Tags"],
-                    "status": ec2_instance["Status"],
-                    "potential_cost_savings": ec2_instance["PotentialCostSavings"].split(" ")[0],
-                    "recommendations": ec2_instance["Recommendations"]
-                }
-            )
-            region.stopped_ec2_instances.add(instance)
-
-    def update_rds_instances(self, region, resources):
-        # Unused RDS Instances
-        region.unused_rds_instances.clear()
-        for rds_instance in resources.get("UnusedRDSInstances", []):
-            instance, _ = RDSInstance.objects.get_or_create(
-                db_instance_identifier=rds_instance["DBInstanceIdentifier"],
-                defaults={
-                    "db_instance_class": rds_instance["DBInstanceClass"],
-                    "backup_type": rds_instance["BackupType"],
-                    "region": rds_instance["Region"],
-                    "potential_cost_savings": rds_instance["PotentialCostSavings"].split(" ")[0],
-                    "recommendations": rds_instance["Recommendations"]
-                }
-            )
-            region.unused_rds_instances.add(instance)
-
-    def update_ebs_volumes(self, region, resources):
-        # Available EBS Volumes
-        region.available_ebs_volumes.clear()
-        for ebs_volume in resources.get("AvailableEBSVolumes", []):
-            volume, _ = EBSVolume.objects.get_or_create(
-                volume_id=ebs_volume["VolumeId"],
-                defaults={
-                    "size": ebs_volume["Size"],
-                    "region": ebs_volume["Region"],
-                    "tags": ebs_volume["Tags"],
-                    "potential_cost_savings": ebs_volume["PotentialCostSavings"].split(" ")[0],
-                    "recommendations": ebs_volume["Recommendations"]
-                }
-            )
-            region.available_ebs_volumes.add(volume)
-
-    def update_rds_snapshots(self, region, resources):
-        # Old RDS Snapshots
-        region.old_rds_snapshots.clear()
-        for rds_snapshot in resources.get("OldRDSSnapshots", []):
-            snapshot, _ = RDSSnapshot.objects.get_or_create(
-                snapshot_id=rds_snapshot["SnapshotId"],
-                defaults={
-                    "creation_date": rds_snapshot["CreationDate"],
-                    "region": rds_snapshot["Region"],
-                    "potential_cost_savings": rds_snapshot["PotentialCostSavings"].split(" ")[0],
-                    "recommendations": rds_snapshot["Recommendations"]
-                }
-            )
-            region.old_rds_snapshots.add(snapshot)
-
-    def update_ec2_snapshots(self, region, resources):
-        # Old EC2 Snapshots
-        region.old_ec2_snapshots.clear()
-        for ec2_snapshot in resources.get("OldEBSSnapshots", []):
-            snapshot, _ = EC2Snapshot.objects.get_or_create(
-                snapshot_id=ec2_snapshot["SnapshotId"],
-                defaults={
-                    "creation_date": ec2_snapshot["StartTime"],
-                    "region": ec2_snapshot["Region"],
-                    "potential_cost_savings": ec2_snapshot["PotentialCostSavings"].split(" ")[0],
-                    "recommendations": ec2_snapshot["Recommendations"]
-                }
-            )
-            region.old_ec2_snapshots.add(snapshot)
-
-    def update_elastic_ips(self, region, resources):
-        # Unused Elastic IPs
-        region.unused_elastic_ips.clear()
-        for elastic_ip in resources.get("AvailableElasticIPs", []):
-            eip, _ = ElasticIP.objects.get_or_create(
-                allocation_id=elastic_ip["AllocationId"],
-                defaults={
-                    "public_ip": elastic_ip["PublicIp"],
-                    "region": elastic_ip["Region"],
-                    "tags": elastic_ip["Tags"],
-                    "potential_cost_savings": elastic_ip["PotentialCostSavings"].split(" ")[0],
-                    "recommendations": elastic_ip["Recommendations"],
-                }
-            )
-            region.unused_elastic_ips.add(eip)
-
-class IAMUserListView(ListAPIView):
+        # Reuse a refresh that is already queued or running for this user;
+        # one with other parameters has to finish first
+        job = IngestJob.objects.filter(user=request.user,
+            status__in=IngestJob.ACTIVE_STATUSES).order_by('-created_at').first()
+        if job is not None and (job.force, job.mode) != (force, mode or ''):
+            return Response({"error": "A refresh with other parameters is already running.",
+                             "job": IngestJobSerializer(job).data},
+             status=status.HTTP_409_CONFLICT)
+        if job is None:
+            job = IngestJob.objects.create(user=request.user, force=force, mode=mode or '')
+            try:
+                refresh_data.apply_async(args=[str(job.pk)],
+                    kwargs={'force': force, 'mode': mode}, task_id=str(job.pk))
+            except Exception as e:
+                IngestJob.objects.filter(pk=job.pk).update(
+                    status=IngestJob.FAILURE, result={"error": str(e)},
+                    finished_at=timezone.now())
+                return Response({"error": f"Could not queue refresh: {str(e)}"},
+                 status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        return Response(IngestJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+class IngestJobStatusView(RetrieveAPIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [JWTAuthentication]
+    serializer_class = IngestJobSerializer
+    lookup_field = 'id'
+    lookup_url_kwarg = 'job_id'
+
+    def get_queryset(self):
+        return IngestJob.objects.filter(user=self.request.user)
+
+class AccountScopedMixin:
+    # Rows of the request user's account only
+    def get_queryset(self):
+        return scoped(super().get_queryset(), request_scope(self.request))
+
+class ValuesListMixin:
+    # list() for ListAPIViews over the flat serializers, rendering rows via
+    # ValuesSerializer; same response as the default list()
+    def list(self, request, *args, **kwargs):
+        fast = values_serializer(self.get_serializer_class())
+        queryset = fast.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(
+                [fast.to_representation(row) for row in page])
+        return Response([fast.to_representation(row) for row in queryset])
+
+class IAMUserListView(AccountScopedMixin, ValuesListMixin, ListAPIView):
     permission_classes = [IsAuthenticated]
     authentication_classes = [JWTAuthentication]
     queryset = IAMUser.objects.all()
     serializer_class = IAMUserSerializer
 
-class S3BucketListView(ListAPIView):
+    @conditional_get
+    @generation_cached
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+class S3BucketListView(AccountScopedMixin, ValuesListMixin, ListAPIView):
     permission_classes = [IsAuthenticated]
     authentication_classes = [JWTAuthentication]
     queryset = S3Bucket.objects.all()
     serializer_class = S3BucketSerializer
 
-class RegionDetailView(RetrieveAPIView):
+    @conditional_get
+    @generation_cached
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+class RegionDetailView(AccountScopedMixin, RetrieveAPIView):
     permission_classes = [IsAuthenticated]
     authentication_classes = [JWTAuthentication]
     queryset = Region.objects.all()
     serializer_class = RegionSerializer
     lookup_field = 'name'
 
+    @conditional_get
+    @generation_cached
+    def get(self, request, *args, **kwargs):
+        # Serve the document rendered at ingest when there is one, otherwise
+        # render from values() rows instead of nested serializers
+        if settings.RMON_REGION_DOCUMENTS and request.accepted_renderer.format == 'json':
+            document = region_document(request_scope(request),
+                                       kwargs[self.lookup_field])
+            if document is not None:
+                return HttpResponse(document, content_type='application/json')
+        region = self.get_object()
+        return Response(region_data(region))
+
 class TotalResourceCountView(APIView):
     permission_classes = [IsAuthenticated]
     authentication_classes = [JWTAuthentication]
+    @conditional_get
+    @generation_cached
     def get(self, request, *args, **kwargs):
         try:
-            regions = Region.objects.all()
+            # Counts per resource type are annotated, one query in total
+            regions = with_resource_counts(scoped(
+                Region.objects.order_by('name'), request_scope(request)))
             serializer = RegionResourceCountSerializer(regions, many=True)
             return Response(serializer.data, status=status.HTTP_200_OK)
         except Exception as e:
@@ -285,27 +170,109 @@ class TotalResourceCountView(APIView):
 class AllResourcesView(APIView):
     permission_classes = [IsAuthenticated]
     authentication_classes = [JWTAuthentication]
+    @conditional_get
+    @generation_cached
     def get(self, request, *args, **kwargs):
-        # Fetch all resources
-        ec2_instances = EC2Instance.objects.all()
-        rds_instances = RDSInstance.objects.all()
-        ebs_volumes = EBSVolume.objects.all()
-        rds_snapshots = RDSSnapshot.objects.all()
-        ec2_snapshots = EC2Snapshot.objects.all()
-        elastic_ips = ElasticIP.objects.all()
-        
-        # Serialize data
+        # ?stream=ndjson streams every resource as newline-delimited JSON
+        scope = request_scope(request)
+        if request.query_params.get('stream') == 'ndjson':
+            return StreamingHttpResponse(self.stream_ndjson(scope),
+                                         content_type='application/x-ndjson')
+
+        # Fetch and serialize all resources from values() rows
         data = {
-            'ec2_instances': EC2InstanceSerializer(ec2_instances, many=True).data,
-            'rds_instances': RDSInstanceSerializer(rds_instances, many=True).data,
-            'ebs_volumes': EBSVolumeSerializer(ebs_volumes, many=True).data,
-            'rds_snapshots': RDSSnapshotSerializer(rds_snapshots, many=True).data,
-            'ec2_snapshots': EC2SnapshotSerializer(ec2_snapshots, many=True).data,
-            'elastic_ips': ElasticIPSerializer(elastic_ips, many=True).data
+            name: values_serializer(serializer_class).rows(
+                scoped(serializer_class.Meta.model.objects.all(), scope))
+            for name, serializer_class in RESOURCE_SERIALIZERS.items()
         }
 
         return Response(data, status=status.HTTP_200_OK)
 
+    def stream_ndjson(self, scope):
+        # One JSON document per line: {"type": ..., "data": {...}}. Rows are
+        # read with a server-side cursor and serialized one by one, so the
+        # worker never holds a whole table
+        chunk_size = settings.RMON_STREAM_QUERY_CHUNK_SIZE
+        encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+        for name, serializer_class in RESOURCE_SERIALIZERS.items():
+            rows = values_serializer(serializer_class).iter_rows(
+                scoped(serializer_class.Meta.model.objects.order_by('id'), scope),
+                chunk_size)
+            for row in rows:
+                yield encoder.encode({'type': name, 'data': row}) + '\n'
+
+
+class ResourceListView(ValuesListMixin, ListAPIView):
+    # Cursor-paginated list of one resource type:
+    # /resources/<ec2_instances|rds_instances|...>/?page_size=&cursor=
+    # Filtering and ordering: see rmon.filters
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [JWTAuthentication]
+    pagination_class = ResourceCursorPagination
+    filter_backends = [ResourceFilter, ResourceOrderingFilter]
+    ordering = ('id',)
+
+    def get_serializer_class(self):
+        serializer_class = RESOURCE_SERIALIZERS.get(self.kwargs['resource_type'])
+        if serializer_class is None:
+            raise Http404
+        return serializer_class
+
+    def get_queryset(self):
+        return scoped(self.get_serializer_class().Meta.model.objects.all(),
+                      request_scope(self.request))
+
+    @conditional_get
+    @generation_cached
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+
+class TopSavingsView(ValuesListMixin, ListAPIView):
+    # Largest savings across every resource type and region, read from the
+    # ranking rebuilt at ingest: /top-savings/?limit=50
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [JWTAuthentication]
+    serializer_class = SavingsRankingSerializer
+
+    def get_queryset(self):
+        try:
+            limit = int(self.request.query_params.get('limit', 50))
+        except ValueError:
+            raise ValidationError({"limit": "A number is required."})
+        limit = max(1, min(limit, settings.RMON_SAVINGS_RANKING_SIZE))
+        return scoped(SavingsRanking.objects.order_by('rank'),
+                      request_scope(self.request))[:limit]
+
+    @conditional_get
+    @generation_cached
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+
+class SavingsSummaryView(ValuesListMixin, ListAPIView):
+    # Count, total and largest savings and the oldest creation date per
+    # region and resource type, from the summary written at ingest:
+    # /savings-summary/?region=us-east-1&resource_type=ec2_instances
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [JWTAuthentication]
+    serializer_class = SavingsSummarySerializer
+    pagination_class = None
+
+    def get_queryset(self):
+        queryset = scoped(SavingsSummary.objects.order_by('region', 'resource_type'),
+                          request_scope(self.request))
+        for param in ('region', 'resource_type'):
+            value = self.request.query_params.get(param)
+            if value:
+                queryset = queryset.filter(**{param: value})
+        return queryset
+
+    @conditional_get
+    @generation_cached
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
 
 class FetchAccountDetailsView(APIView):
     permission_classes = [IsAuthenticated]
@@ -321,10 +288,12 @@ class LatestCumulativeCostView(APIView):
     permission_classes = [IsAuthenticated]
     authentication_classes = [JWTAuthentication]
 
+    @conditional_get
     def get(self, request, *args, **kwargs):
         try:
             # Get the latest cumulative cost record
-            latest_cost = CumulativeCost.objects.latest('last_updated')
+            latest_cost = scoped(CumulativeCost.objects.all(),
+                                 request_scope(request)).latest('last_updated')
             data = {
                 'ec2_cost': latest_cost.ec2_cost,
                 'rds_cost': latest_cost.rds_cost,
@@ -345,6 +314,7 @@ class CumulativeCostRangeView(APIView):
     permission_classes = [IsAuthenticated]
     authentication_classes = [JWTAuthentication]
 
+    @conditional_get
     def get(self, request, *args, **kwargs):
         start_date_str = request.query_params.get('start_date')
         end_date_str = request.query_params.get('end_date')
@@ -362,35 +332,57 @@ class CumulativeCostRangeView(APIView):
             if start_date is None or end_date is None:
                 return Response({"error": "Invalid date format."}, status=400)
 
-            # Query the cumulative cost history within the date range
-            cost_history = CumulativeCostHistory.objects.filter(
-                recorded_at__range=[start_date, end_date])
+            scope = request_scope(request)
+            bucket = request.query_params.get('bucket')
+            if bucket:
+                return self.bucketed(scope.account_id, bucket, start_date, end_date)
 
-            if not cost_history.exists():
+            # Raw samples, and rollup averages where the raw history has
+            # been compacted away
+            rows = cost_points(scope.account_id, start_date, end_date)
+            if not rows:
                 return Response(
                     {"message": "No data available for the given date range."}, 
                     status=404)
 
-            # Initialize empty lists for each cost type
-            data = {
-                'ec2_cost': [],
-                'rds_cost': [],
-                'ebs_cost': [],
-                'rds_snapshots_cost': [],
-                'ebs_snapshots_cost': [],
-                'elastic_ips_cost': []
-            }
-
-            # Populate the lists with data from the queried records
-            for record in cost_history:
-                data['ec2_cost'].append(record.ec2_cost)
-                data['rds_cost'].append(record.rds_cost)
-                data['ebs_cost'].append(record.ebs_cost)
-                data['rds_snapshots_cost'].append(record.rds_snapshots_cost)
-                data['ebs_snapshots_cost'].append(record.ebs_snapshots_cost)
-                data['elastic_ips_cost'].append(record.elastic_ips_cost)
+            # One list per cost type, plus the matching timestamps
+            data = {'recorded_at': [row[0] for row in rows]}
+            for index, field in enumerate(COST_FIELDS, start=1):
+                data[field] = [row[index] for row in rows]
 
             return Response(data, status=200)
 
         except ValueError as e:
-            return Response({"error": str(e)}, status=400)
\ No newline at end of file
+            return Response({"error": str(e)}, status=400)
+
+    def bucketed(self, account_id, bucket, start_date, end_date):
+        # Aggregated in the database from the cost rollups and the raw
+        # history, one point per hour/day/week/month
+        if bucket not in COST_BUCKETS:
+            return Response(
+                {"error": f"Invalid bucket. Use one of: {', '.join(COST_BUCKETS)}."},
+                status=400)
+        max_points = settings.RMON_COST_RANGE_MAX_POINTS
+        if bucket_count(start_date, end_date, bucket) > max_points:
+            return Response(
+                {"error": f"The date range spans more than {max_points} '{bucket}' "
+                          "buckets, use a coarser bucket or a shorter range."},
+                status=400)
+
+        points = bucketed_costs(account_id, start_date, end_date, bucket)[:max_points]
+        if not points:
+            return Response(
+                {"message": "No data available for the given date range."},
+                status=404)
+
+        data = {
+            'bucket': bucket,
+            'recorded_at': [point['bucket'] for point in points],
+            'samples': [point['samples'] for point in points],
+        }
+        for field in COST_FIELDS:
+            data[field] = {
+                stat: [point[f"{field}_{stat}"] for point in points]
+                for stat in ('avg', 'min', 'max')
+            }
+        return Response(data, status=200)
\ No newline at end of file